@@ -1,4 +1,3 @@
-import json
 import logging
 import os
 import sys
@@ -12,12 +11,25 @@ cwd = os.getcwd()
 if cwd not in sys.path:
     sys.path.append(cwd)
 
-from legal_rag.contracts.parsing import Section
-from legal_rag.contracts.prompts import Context, build_context, build_prompt
-from legal_rag.contracts.questions import Question, all_questions, qa_parser
-from legal_rag.contracts.utils import select_index_section
-from legal_rag.loaders import parse_pdf
-from legal_rag.models.oai import native_oai_chain
+from legal_rag import tracing
+from legal_rag.contracts.prompts import Context, assemble_context, build_prompt
+from legal_rag.contracts.questions import (
+    AnswerSet,
+    Question,
+    all_questions,
+    qa_parser,
+)
+from legal_rag.contracts.tokens import get_token_counter
+from legal_rag.contracts.utils import warmup_semantic_selection
+from legal_rag.loaders import (
+    extracted_page_count,
+    parse_pdf,
+    update_parsed_pdf_cache,
+)
+from legal_rag.models.oai import native_oai_chain, stream_answers
+from legal_rag.models.usage import usage_scope
+from legal_rag.pipeline import prepare_question_set, select_section, select_sections
+from legal_rag.prefetch import DocumentPrefetcher
 from legal_rag.utils import display_document
 
 logging.basicConfig(
@@ -25,39 +37,105 @@ logging.basicConfig(
 )
 logger = logging.getLogger("demo_app:main")
 
-USE_THREADS = False  # not working
+USE_THREADS = True  # parse and prepare the contexts in the background
 OAI_MODEL_NAME = "gpt-4"  # "gpt-4-1106-preview"
 CRITERIA = "lexico"  # "semantica"
+# "auto", "pdfminer" or "pdfminer-outline"; "pypdf" and "pdfminer-nolayout" lose the
+# paragraph breaks of the index, their sections are located by keywords instead
+EXTRACTION_BACKEND = "auto"
+MAX_CONTEXT_TOKENS = None  # cap on the context tokens, besides the model limit
+TOKENIZER = "estimate"  # "tiktoken"
+WARMUP_EMBEDDINGS = True  # load the embedding model once, when the app starts
+STREAM_ANSWERS = True  # show each answer as soon as the model writes it
+VIEW_SECTION_ONLY = True  # show only the pages of the section, not the whole PDF
+PREWARM_ANSWERS = False  # answer every question set in the background (API costs!)
 LAST_CALL_OAI = ...
 
 
-def st_build_context(pages, doc_index, selected_questions) -> Context:
+def st_build_context(
+    pages, doc_index, selected_questions, extraction_prompt
+) -> Context:
     """
     Build the context for the selected questions.
     Might use threads to not wait for the context to be built.
     """
 
     # Using criteria=semantica takes at least 2 minutes to run
-    # @st.cache_data
-    def st_select_index_section(raw_sections, q_name, criteria="semantica"):
-        if q_name == "Indicadores Clave de Desempeño":
-            raw_sections = [
-                s for s in raw_sections if s["name"] in doc_index.annex_names
-            ]
-        selected_section = select_index_section(raw_sections, q_name, criteria=criteria)
-        return selected_section
-
-    # select section using raw sections, this is used to cache the results
     logging.info("Selecting section")
-    raw_sections = [json.loads(s.model_dump_json()) for s in doc_index.sections]
-    selected_section = st_select_index_section(raw_sections, selected_questions.name)
-    selected_section = Section(**selected_section)
+    selected_section = select_section(
+        doc_index, selected_questions.name, criteria=CRITERIA
+    )
 
-    context_fn = partial(build_context, selected_section=selected_section, pages=pages)
+    context_fn = partial(
+        assemble_context,
+        selected_section=selected_section,
+        pages=pages,
+        selected_questions=selected_questions,
+        extraction_prompt=extraction_prompt,
+        model_name=OAI_MODEL_NAME,
+        max_context_tokens=MAX_CONTEXT_TOKENS,
+        token_counter=get_token_counter(TOKENIZER, model_name=OAI_MODEL_NAME),
+    )
     logging.info("Returning Context and thread")
     return context_fn()
 
 
+@st.cache_resource
+def st_warmup_embeddings():
+    """
+    Load the embedding model and keyword embeddings once per process,
+    so semantic section selection does not pay for it on every run.
+    """
+    logging.info("Warming up the embedding model")
+    warmup_semantic_selection()
+
+
+def parse_document(uploaded_file):
+    results = parse_pdf(uploaded_file, backend=EXTRACTION_BACKEND)
+    return results[0], results[1]
+
+
+def st_prefetcher(uploaded_file) -> DocumentPrefetcher:
+    """
+    Prefetcher of the uploaded file, kept in the session. Uploading another
+    file cancels the work left for the previous one.
+    """
+    file_id = getattr(uploaded_file, "file_id", None)
+    file_id = file_id or f"{uploaded_file.name}:{uploaded_file.size}"
+    if st.session_state.get("prefetch_file_id") == file_id:
+        return st.session_state.prefetcher
+
+    st_cancel_prefetch()
+    prepare_fn = partial(
+        prepare_question_set,
+        model_name=OAI_MODEL_NAME,
+        criteria=CRITERIA,
+        max_context_tokens=MAX_CONTEXT_TOKENS,
+        token_counter=get_token_counter(TOKENIZER, model_name=OAI_MODEL_NAME),
+    )
+    prewarm_fn = None
+    if PREWARM_ANSWERS:
+        prewarm_fn = partial(native_oai_chain, model_name=OAI_MODEL_NAME)
+    logger.info(f"Parsing {uploaded_file.name} in the background")
+    st.session_state.prefetcher = DocumentPrefetcher(
+        partial(parse_document, uploaded_file),
+        prepare_fn,
+        list(all_questions.values()),
+        prewarm_fn=prewarm_fn,
+        route_fn=partial(select_sections, criteria=CRITERIA),
+    ).start()
+    st.session_state.prefetch_file_id = file_id
+    return st.session_state.prefetcher
+
+
+def st_cancel_prefetch():
+    if st.session_state.get("prefetcher") is not None:
+        logger.info("Cancelling the background work of the previous file")
+        st.session_state.prefetcher.cancel()
+    st.session_state.prefetcher = None
+    st.session_state.prefetch_file_id = None
+
+
 def select_question_set() -> Question:
     """
     Display a select widget with the different question sets.
@@ -77,29 +155,27 @@ def select_question_set() -> Question:
     return None
 
 
-def run_pipeline(pages, doc_index, qset, uploaded_file=None):
-    logging.info("Displaying questions")
-    st.write(f"### You've selected the following question set: {qset.name}")
-    st.write(f"Questions are: **{qset.description or qset.name}**.")
-
-    if (
-        qset.name == "Indicadores Clave de Desempeño"
-        and not doc_index.contains_kpi_annex
-    ):
-        st.write(f"**No KPI appendix was found.**")
-        return None, None
-
-    ctx = st_build_context(pages, doc_index, qset)
-    parser, format_instructions = qa_parser()
-    extraction_prompt = build_prompt(
-        selected_questions=qset, format_instructions=format_instructions
-    )
-    if ctx is None:
-        raise ValueError("Context is None")
-
-    # logger.info(extraction_prompt.format(context=ctx.str_context)[:1000])
-    logger.info(f"Context: {ctx.section_name}, starts at page {ctx.page}")
-
+def st_stream_answers(extraction_prompt, ctx) -> AnswerSet:
+    """
+    Write each answer as soon as it is complete, instead of waiting
+    for the whole `AnswerSet`.
+    """
+    answers = []
+    status = st.empty()
+    status.info("Answering questions...")
+    for answer in stream_answers(extraction_prompt, ctx, model_name=OAI_MODEL_NAME):
+        if not answers:
+            logger.info("First answer received")
+        name = answer.question_answered.name if answer.question_answered else ""
+        st.write(f"- **{name}**:")
+        st.write(f"{answer.text}")
+        answers.append(answer)
+    status.empty()
+    return AnswerSet(answers=answers)
+
+
+def st_answer_questions(extraction_prompt, ctx, qset, pages, doc_index):
+    """Answer the questions in a single call and write them once all are ready."""
     # sleep 3 seconds to give time to the user to read the text
     time.sleep(3)
     # write a quote in markdown with the selected section name
@@ -129,12 +205,60 @@ def run_pipeline(pages, doc_index, qset, uploaded_file=None):
     else:
         logger.warning(f"Response is not a json nor an AnswerSet: {type(response)}")
         st.write(f"{response}")
-    # with col2:
+
+    return response
+
+
+def run_pipeline(pages, doc_index, qset, uploaded_file=None, prefetcher=None):
+    logging.info("Displaying questions")
+    st.write(f"### You've selected the following question set: {qset.name}")
+    st.write(f"Questions are: **{qset.description or qset.name}**.")
+
+    if (
+        qset.name == "Indicadores Clave de Desempeño"
+        and not doc_index.contains_kpi_annex
+    ):
+        st.write(f"**No KPI appendix was found.**")
+        return None, None
+
+    if prefetcher is not None:
+        with st.spinner("Preparing the context..."):
+            extraction_prompt, ctx = prefetcher.context(qset)
+    else:
+        parser, format_instructions = qa_parser()
+        extraction_prompt = build_prompt(
+            selected_questions=qset, format_instructions=format_instructions
+        )
+        ctx = st_build_context(pages, doc_index, qset, extraction_prompt)
+    if ctx is None:
+        raise ValueError("Context is None")
+
+    # logger.info(extraction_prompt.format(context=ctx.str_context)[:1000])
+    logger.info(
+        f"Context: {ctx.section_name}, starts at page {ctx.page}, uses pages {ctx.pages_used}"
+    )
+
+    file_name = uploaded_file.name if uploaded_file is not None else None
+    with tracing.request("answer_question_set", question_set=qset.name), usage_scope(
+        document=file_name, question_set=qset.name
+    ):
+        if STREAM_ANSWERS:
+            st.write(f"### Searching answer in {ctx.section_name}")
+            response = st_stream_answers(extraction_prompt, ctx)
+            logger.info(f"Response: {response}, type: {type(response)}")
+        else:
+            response = st_answer_questions(
+                extraction_prompt, ctx, qset, pages, doc_index
+            )
 
     if display_document is not None:
+        page_range = None
+        if VIEW_SECTION_ONLY and ctx.end_page is not None:
+            page_range = (ctx.page, ctx.end_page)
         display_document(
             uploaded_file=uploaded_file,
             specific_page=ctx.context[0].metadata["page"] + 1,
+            page_range=page_range,
         )
 
     return ctx, response
@@ -144,6 +268,8 @@ def main():
     # Set the title and description of the app
     st.title("Document Augmented Retrieval for Legal Documents")
     st.write("Upload a legal document and ask questions about it.")
+    if WARMUP_EMBEDDINGS and CRITERIA == "semantica":
+        st_warmup_embeddings()
     pages, doc_index, qset = None, None, None
 
     # Create a file upload widget
@@ -152,14 +278,41 @@ def main():
     )
 
     if uploaded_file is None:
+        st_cancel_prefetch()
         st.info("Suba un contrato.")
 
+    elif USE_THREADS:
+        # the question picker is shown while the file is parsed
+        prefetcher = st_prefetcher(uploaded_file)
+        st.write("**Retrieving info on:**")
+        st.write(f"{uploaded_file.name}")
+        if prefetcher.parsing:
+            st.caption("Extracting text from the document in the background...")
+        qset = select_question_set()
+
+        if qset is not None:
+            with st.spinner("Extracting text from the document..."):
+                pages, doc_index = prefetcher.parsed()
+            logger.info(
+                f"Running pipeline with: qset={qset.name}, pages={len(pages)}, doc_index={len(doc_index.sections)}"
+            )
+            ctx, response = run_pipeline(
+                pages=pages,
+                doc_index=doc_index,
+                qset=qset,
+                uploaded_file=uploaded_file,
+                prefetcher=prefetcher,
+            )
+            logger.info(
+                f"Extracted {extracted_page_count(pages)} of {len(pages)} pages for this request"
+            )
+            update_parsed_pdf_cache(pages, doc_index)
+
     elif uploaded_file is not None:
-        # HERE: [threading] we can use threads to not wait for the file to be parsed
         with st.spinner("Extracting text from the document..."):
-            results = parse_pdf(uploaded_file)
+            with tracing.request("parse_document", file=uploaded_file.name):
+                pages, doc_index = parse_document(uploaded_file)
 
-        pages, doc_index = results[0], results[1]
         st.write("**Retrieving info on:**")
         st.write(f"{pages[0].metadata['file_name']}")
         qset = select_question_set()
@@ -174,6 +327,10 @@ def main():
             ctx, response = run_pipeline(
                 pages=pages, doc_index=doc_index, qset=qset, uploaded_file=uploaded_file
             )
+            logger.info(
+                f"Extracted {extracted_page_count(pages)} of {len(pages)} pages for this request"
+            )
+            update_parsed_pdf_cache(pages, doc_index)
     else:
         st.error("Loading error.")
 
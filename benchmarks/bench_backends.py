@@ -0,0 +1,108 @@
+"""
+Compare the text extraction backends on a corpus of PDF files, by default
+the synthetic contracts of the tests in both languages.
+
+Usage:
+    python benchmarks/bench_backends.py [--pages 10,100]
+    python benchmarks/bench_backends.py path/to/corpus [more.pdf ...]
+
+For every backend prints the pages/sec and the agreement of its text with the
+full layout pdfminer backend, measured as the overlap of the bags of words of
+each page (1.0 means the same words, in any order and with any whitespace).
+"""
+
+import argparse
+import glob
+import os
+import sys
+import time
+from collections import Counter
+
+cwd = os.getcwd()
+# update path
+if cwd not in sys.path:
+    sys.path.append(cwd)
+
+from legal_rag.loaders.backends import BACKENDS, PDFMinerBackend
+from legal_rag.loaders.pdfminer import _extract_page_range
+from legal_rag.tests.synthetic import SECTION_NAMES, generate_contract
+
+
+def collect_files(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "**", "*.pdf"), recursive=True)))
+        else:
+            files.append(path)
+    return files
+
+
+def synthetic_corpus(sizes):
+    corpus = {}
+    for n_pages in sizes:
+        for language in SECTION_NAMES:
+            contract = generate_contract(n_pages, language=language)
+            corpus[f"synthetic_{n_pages}p_{language}.pdf"] = contract.pdf
+    return corpus
+
+
+def word_agreement(reference: str, text: str) -> float:
+    reference, text = Counter(reference.split()), Counter(text.split())
+    total = max(sum(reference.values()), sum(text.values()))
+    if total == 0:
+        return 1.0
+    return sum((reference & text).values()) / total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "paths", nargs="*", help="PDF files or directories, synthetic contracts if none"
+    )
+    parser.add_argument(
+        "--pages",
+        default="10,100",
+        help="comma separated page counts of the synthetic contracts",
+    )
+    args = parser.parse_args()
+
+    if args.paths:
+        corpus = {}
+        for path in collect_files(args.paths):
+            with open(path, "rb") as f:
+                corpus[path] = f.read()
+    else:
+        corpus = synthetic_corpus(int(n) for n in args.pages.split(","))
+    files = list(corpus)
+
+    timings, texts = {}, {}
+    for backend in BACKENDS:
+        timings[backend] = 0.0
+        texts[backend] = {}
+        for path, bytes_data in corpus.items():
+            s_time = time.perf_counter()
+            texts[backend][path] = [
+                text for text, _ in _extract_page_range(bytes_data, backend=backend)
+            ]
+            timings[backend] += time.perf_counter() - s_time
+
+    reference = texts[PDFMinerBackend.name]
+    n_pages = sum(len(pages) for pages in reference.values())
+    print(f"{len(files)} files, {n_pages} pages")
+    print(f"{'backend':>18} {'seconds':>9} {'pages/sec':>10} {'agreement':>10}")
+    for backend in BACKENDS:
+        agreements = [
+            word_agreement(ref_page, page)
+            for path in files
+            for ref_page, page in zip(reference[path], texts[backend][path])
+        ]
+        agreement = sum(agreements) / max(len(agreements), 1)
+        print(
+            f"{backend:>18} {timings[backend]:>9.2f} "
+            f"{n_pages / timings[backend]:>10.1f} {agreement:>10.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
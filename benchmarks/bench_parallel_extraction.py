@@ -0,0 +1,62 @@
+"""
+Benchmark the parallel page extraction of PDFMinerReader.
+
+Usage:
+    python benchmarks/bench_parallel_extraction.py contract.pdf --max-workers 8
+
+Prints the pages/sec obtained with 1..N worker processes and checks that the
+extracted pages are identical to the serial extraction.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+cwd = os.getcwd()
+# update path
+if cwd not in sys.path:
+    sys.path.append(cwd)
+
+from legal_rag.loaders.pdfminer import PDFMinerReader
+
+
+def run(path, n_workers, chunk_size=None, repeat=1):
+    reader = PDFMinerReader(path)
+    best, pages = None, None
+    for _ in range(repeat):
+        s_time = time.perf_counter()
+        pages = reader.load_data(n_workers=n_workers, chunk_size=chunk_size)
+        elapsed = time.perf_counter() - s_time
+        best = elapsed if best is None else min(best, elapsed)
+    return pages, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("path", help="PDF file to extract")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count())
+    parser.add_argument("--chunk-size", type=int, default=None)
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+
+    baseline, base_time = run(args.path, 1, repeat=args.repeat)
+    n_pages = len(baseline)
+    print(f"{args.path}: {n_pages} pages")
+    print(f"{'workers':>8} {'seconds':>9} {'pages/sec':>10} {'speedup':>8}")
+    print(f"{1:>8} {base_time:>9.2f} {n_pages / base_time:>10.1f} {1.0:>8.2f}")
+
+    for n_workers in range(2, args.max_workers + 1):
+        pages, elapsed = run(args.path, n_workers, args.chunk_size, args.repeat)
+        if [p.page_content for p in pages] != [p.page_content for p in baseline]:
+            raise AssertionError(f"Output with {n_workers} workers differs")
+        if [p.metadata for p in pages] != [p.metadata for p in baseline]:
+            raise AssertionError(f"Metadata with {n_workers} workers differs")
+        print(
+            f"{n_workers:>8} {elapsed:>9.2f} {n_pages / elapsed:>10.1f} "
+            f"{base_time / elapsed:>8.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""
+Headless batch ingestion of contracts.
+
+Usage:
+    python -m legal_rag.cli "contracts/**/*.pdf" -o parsed.jsonl --workers 8
+
+Every PDF is extracted and its index parsed in a process pool; one JSON line
+per document (pages, ContractIndex, timings or the error) is appended to the
+output as soon as the document is done. Running the same command again
+resumes: documents already in the output are skipped (with --retry-errors
+failed ones are processed again and a new record is appended for them).
+"""
+
+import argparse
+import glob
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Iterable, List, Set
+
+from legal_rag.contracts.parsing import parse_contract_index
+from legal_rag.loaders.backends import AUTO_BACKEND, BACKENDS
+from legal_rag.loaders.cache import document_key, get_parsed_pdf_cache
+from legal_rag.loaders.pdfminer import PDFMinerReader
+
+logger = logging.getLogger("legal_rag:cli")
+
+
+def collect_files(inputs: Iterable[str]) -> List[str]:
+    """Expand directories (recursively) and glob patterns into PDF paths."""
+    files = []
+    for path in inputs:
+        if os.path.isdir(path):
+            pattern = os.path.join(path, "**", "*.pdf")
+            files.extend(glob.glob(pattern, recursive=True))
+        else:
+            files.extend(glob.glob(path, recursive=True))
+    # keep the first occurrence of each file
+    return list(dict.fromkeys(os.path.abspath(f) for f in sorted(files)))
+
+
+def completed_files(output: str, retry_errors: bool = False) -> Set[str]:
+    """
+    Files already present in ``output``.
+
+    A run that was killed may have left a partially written last line, which is
+    cut off so that new records start on a line of their own.
+    """
+    done = set()
+    if not os.path.exists(output):
+        return done
+
+    valid_size = 0
+    with open(output, "rb") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            if not line.endswith(b"\n"):
+                break
+            valid_size += len(line)
+            if record["status"] == "ok" or not retry_errors:
+                done.add(record["file"])
+
+    if valid_size < os.path.getsize(output):
+        logger.warning(f"Truncating partially written record at byte {valid_size}")
+        with open(output, "r+b") as f:
+            f.truncate(valid_size)
+    return done
+
+
+def ingest_file(path: str, backend: str, use_cache: bool = False) -> dict:
+    """Extract the pages and index of a PDF, errors are reported in the record."""
+    record = {"file": path, "status": "ok", "backend": backend, "timings": {}}
+    timings = record["timings"]
+    s_time = time.perf_counter()
+    try:
+        reader = PDFMinerReader(path, backend=backend)
+        timings["read"] = time.perf_counter() - s_time
+
+        t = time.perf_counter()
+        pages = reader.load_data()
+        timings["extract"] = time.perf_counter() - t
+        record["n_pages"] = len(pages)
+        record["pages"] = [page.page_content for page in pages]
+
+        t = time.perf_counter()
+        contract_index = parse_contract_index(pages)
+        timings["index"] = time.perf_counter() - t
+        record["contract_index"] = contract_index.model_dump()
+
+        if use_cache:
+            cache_key = document_key(reader.bytes_data, backend)
+            get_parsed_pdf_cache().put(cache_key, pages, contract_index)
+
+    except Exception as e:
+        record["status"] = "error"
+        record["error"] = f"{type(e).__name__}: {e}"
+
+    timings["total"] = time.perf_counter() - s_time
+    return record
+
+
+def ingest(
+    files: List[str],
+    output: str,
+    n_workers: int = None,
+    backend: str = AUTO_BACKEND,
+    use_cache: bool = False,
+    retry_errors: bool = False,
+) -> int:
+    """Ingest ``files`` into ``output``, returns the number of failed documents."""
+    done = completed_files(output, retry_errors=retry_errors)
+    pending = [f for f in files if f not in done]
+    logger.info(f"{len(files)} files, {len(done)} already done, {len(pending)} to go")
+
+    n_errors = 0
+    with open(output, "a", encoding="utf-8") as out, ProcessPoolExecutor(
+        max_workers=n_workers
+    ) as executor:
+        futures = [
+            executor.submit(ingest_file, path, backend, use_cache) for path in pending
+        ]
+        for i, future in enumerate(as_completed(futures), start=1):
+            record = future.result()
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+
+            if record["status"] != "ok":
+                n_errors += 1
+                logger.warning(f"{record['file']}: {record['error']}")
+            logger.info(
+                f"[{i}/{len(pending)}] {record['file']} in {record['timings']['total']:.2f}s"
+            )
+    return n_errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Extract the pages and index of a batch of contracts to JSONL."
+    )
+    parser.add_argument(
+        "inputs", nargs="+", help="directories or glob patterns of PDFs"
+    )
+    parser.add_argument("-o", "--output", required=True, help="JSONL output file")
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=None,
+        help="worker processes (default: CPUs)",
+    )
+    parser.add_argument(
+        "--backend",
+        default=AUTO_BACKEND,
+        choices=[AUTO_BACKEND, *BACKENDS],
+        help="text extraction backend, the same as the app's for --cache to be used by it",
+    )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="also store the results in the parsed PDF cache, under the --backend",
+    )
+    parser.add_argument(
+        "--retry-errors",
+        action="store_true",
+        help="process again the documents that failed in a previous run",
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    files = collect_files(args.inputs)
+    n_errors = ingest(
+        files,
+        args.output,
+        n_workers=args.workers,
+        backend=args.backend,
+        use_cache=args.cache,
+        retry_errors=args.retry_errors,
+    )
+    return 1 if n_errors > 0 else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,176 @@
+"""Chunks of a document stored as offsets into a single text buffer."""
+
+import re
+from typing import Iterator, List, Optional, Sequence
+
+import numpy as np
+
+from legal_rag.contracts.retrieval import Chunk
+
+# every run of whitespace is a place where a chunk can end, ranked by what it separates
+WHITESPACE = re.compile(r"\s+")
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+SENTENCE_END = ".!?;:"
+WORD, SENTENCE, PARAGRAPH = 0, 1, 2
+
+PAGE_SEPARATOR = "\n\n"
+
+
+def _boundaries(text: str):
+    """Start, end and level (word, sentence or paragraph) of every whitespace run."""
+    starts, ends, levels = [], [], []
+    for match in WHITESPACE.finditer(text):
+        start, end = match.span()
+        if PARAGRAPH_BREAK.search(text, start, end):
+            level = PARAGRAPH
+        elif start > 0 and text[start - 1] in SENTENCE_END:
+            level = SENTENCE
+        else:
+            level = WORD
+        starts.append(start)
+        ends.append(end)
+        levels.append(level)
+    return (
+        np.array(starts, dtype=np.int64),
+        np.array(ends, dtype=np.int64),
+        np.array(levels, dtype=np.int8),
+    )
+
+
+class ChunkIndex:
+    """
+    Chunks of a text as ``(start, end)`` offsets into one buffer, with the page
+    of each chunk. A chunk costs three integers, its text is only sliced out
+    of the buffer when it is read.
+
+    `build` packs up to ``max_chars`` characters per chunk, ending each one at
+    the last paragraph break in reach, else the last sentence end, else the
+    last space. With ``overlap`` the next chunk starts at the first word
+    boundary within the last ``overlap`` characters of the previous one.
+    """
+
+    def __init__(
+        self,
+        text: str,
+        starts: np.ndarray,
+        ends: np.ndarray,
+        pages: Optional[np.ndarray] = None,
+    ):
+        self.text = text
+        self.starts = starts
+        self.ends = ends
+        self.pages = (
+            pages if pages is not None else np.zeros(len(starts), dtype=np.int32)
+        )
+
+    @classmethod
+    def build(
+        cls,
+        text: str,
+        max_chars: int = 1000,
+        overlap: int = 0,
+        page_offsets: Optional[Sequence[int]] = None,
+        page_numbers: Optional[Sequence[int]] = None,
+    ) -> "ChunkIndex":
+        """
+        Chunk ``text`` in a single pass over its whitespace. ``page_offsets``
+        are the offsets where each page starts in ``text`` (and
+        ``page_numbers`` their numbers, by default 0, 1, ...).
+        """
+        if overlap >= max_chars:
+            raise ValueError(
+                f"overlap ({overlap}) must be smaller than max_chars ({max_chars})"
+            )
+
+        sep_starts, sep_ends, levels = _boundaries(text)
+        # the text without leading and trailing whitespace
+        pos = int(sep_ends[0]) if len(sep_starts) and sep_starts[0] == 0 else 0
+        stop = len(text)
+        if len(sep_ends) and sep_ends[-1] == len(text):
+            stop = int(sep_starts[-1])
+
+        starts, ends = [], []
+        prev_end = 0
+        while pos < stop:
+            limit = pos + max_chars
+            if limit >= stop:
+                starts.append(pos)
+                ends.append(stop)
+                break
+
+            # boundaries inside the chunk, the best ranked and last of them wins;
+            # with overlap, only those past the end of the previous chunk
+            lo = np.searchsorted(sep_starts, max(pos, prev_end), side="right")
+            hi = np.searchsorted(sep_starts, limit, side="right")
+            if lo < hi:
+                window = levels[lo:hi]
+                best = lo + len(window) - 1 - int(np.argmax(window[::-1]))
+                end, next_pos = int(sep_starts[best]), int(sep_ends[best])
+            else:
+                # a single word longer than max_chars
+                end = next_pos = limit
+            starts.append(pos)
+            ends.append(end)
+            prev_end = end
+
+            if overlap > 0:
+                first = np.searchsorted(sep_ends, end - overlap, side="left")
+                if first < len(sep_ends) and pos < sep_ends[first] < end:
+                    next_pos = int(sep_ends[first])
+            pos = next_pos
+
+        starts = np.array(starts, dtype=np.int64)
+        ends = np.array(ends, dtype=np.int64)
+        pages = None
+        if page_offsets is not None:
+            page_offsets = np.asarray(page_offsets, dtype=np.int64)
+            page_idx = np.searchsorted(page_offsets, starts, side="right") - 1
+            numbers = np.asarray(
+                page_numbers if page_numbers is not None else range(len(page_offsets)),
+                dtype=np.int32,
+            )
+            pages = numbers[page_idx]
+        return cls(text, starts, ends, pages)
+
+    @classmethod
+    def from_pages(
+        cls, pages: Sequence, max_chars: int = 1000, overlap: int = 0
+    ) -> "ChunkIndex":
+        """Chunks of the page `Document`s, pages are joined by a paragraph break."""
+        offsets, offset = [], 0
+        for page in pages:
+            offsets.append(offset)
+            offset += len(page.page_content) + len(PAGE_SEPARATOR)
+        text = PAGE_SEPARATOR.join(page.page_content for page in pages)
+        return cls.build(
+            text,
+            max_chars=max_chars,
+            overlap=overlap,
+            page_offsets=offsets,
+            page_numbers=[page.metadata["page"] for page in pages],
+        )
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def __getitem__(self, i: int) -> str:
+        return self.text[self.starts[i] : self.ends[i]]
+
+    def __iter__(self) -> Iterator[str]:
+        for start, end in zip(self.starts.tolist(), self.ends.tolist()):
+            yield self.text[start:end]
+
+    def chunk(self, i: int) -> Chunk:
+        """Chunk ``i`` with its whitespace collapsed, as used for retrieval."""
+        return Chunk(text=" ".join(self[i].split()), page=int(self.pages[i]), order=i)
+
+    def chunks(self) -> List[Chunk]:
+        return [self.chunk(i) for i in range(len(self))]
+
+    @property
+    def nbytes(self) -> int:
+        """Memory taken by the offsets, the text buffer is not counted."""
+        return self.starts.nbytes + self.ends.nbytes + self.pages.nbytes
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(chunks={len(self)}, chars={len(self.text)})"
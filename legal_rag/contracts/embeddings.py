@@ -0,0 +1,120 @@
+"""Process-wide sentence embedding service used for semantic section selection."""
+
+import logging
+import os
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from legal_rag.cache import DiskCache, cache_dir
+
+DEFAULT_EMBEDDING_MODEL = "hiiamsid/sentence_similarity_spanish_es"
+
+
+def normalize_title(title: str) -> str:
+    """Section titles only differ in case and spacing across our contracts."""
+    return " ".join(title.lower().split())
+
+
+class EmbeddingService:
+    """
+    Keeps a `SentenceTransformer` loaded and caches the embeddings it computes.
+
+    The keyword embeddings of each question set are computed once per process,
+    section titles are encoded in batches and memoized (in memory and in an
+    on-disk `DiskCache` keyed by model and normalized title), since the same
+    headings recur across contracts.
+    """
+
+    def __init__(
+        self,
+        model_name: str = DEFAULT_EMBEDDING_MODEL,
+        store: Optional[DiskCache] = None,
+        batch_size: int = 64,
+    ):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.store = store
+        self._model = None
+        self._lock = threading.Lock()
+        self._keyword_embeddings: Dict[Tuple[str, Tuple[str, ...]], np.ndarray] = {}
+        self._title_embeddings: Dict[str, np.ndarray] = {}
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from sentence_transformers import SentenceTransformer
+
+                    logging.info(f"Loading embedding model {self.model_name}")
+                    self._model = SentenceTransformer(self.model_name)
+        return self._model
+
+    def warmup(self, keyword_sets: Dict[str, Sequence[str]]):
+        """Load the model and precompute the keywords of every question set."""
+        for q_set_name, keywords in keyword_sets.items():
+            self.keyword_embeddings(q_set_name, keywords)
+
+    def encode(self, texts: Sequence[str]) -> np.ndarray:
+        """Encode ``texts`` without any caching."""
+        return self.model.encode(
+            list(texts), batch_size=self.batch_size, convert_to_numpy=True
+        ).astype(np.float32)
+
+    def keyword_embeddings(
+        self, q_set_name: str, keywords: Sequence[str]
+    ) -> np.ndarray:
+        """Embeddings of the (lowercased) section names of a question set."""
+        # keyed by the keywords too, a set can be routed with other keywords
+        key = (q_set_name, tuple(keywords))
+        embeddings = self._keyword_embeddings.get(key)
+        if embeddings is None:
+            embeddings = self.encode([kw.lower() for kw in keywords])
+            self._keyword_embeddings[key] = embeddings
+        return embeddings
+
+    def _store_key(self, title: str) -> str:
+        return f"{self.model_name}:{title}"
+
+    def encode_titles(self, titles: Sequence[str]) -> np.ndarray:
+        """Embeddings of section titles, only unseen titles go through the model."""
+        normalized = [normalize_title(title) for title in titles]
+
+        missing: List[str] = []
+        for title in dict.fromkeys(normalized):
+            if title in self._title_embeddings:
+                continue
+            value = self.store.get(self._store_key(title)) if self.store else None
+            if value is not None:
+                self._title_embeddings[title] = np.frombuffer(value, dtype=np.float32)
+            else:
+                missing.append(title)
+
+        if len(missing) > 0:
+            logging.info(f"Encoding {len(missing)} new section titles")
+            for title, embedding in zip(missing, self.encode(missing)):
+                self._title_embeddings[title] = embedding
+                if self.store is not None:
+                    self.store.set(self._store_key(title), embedding.tobytes())
+
+        return np.stack([self._title_embeddings[title] for title in normalized])
+
+
+_services: Dict[str, EmbeddingService] = {}
+_services_lock = threading.Lock()
+
+
+def get_embedding_service(
+    model_name: str = DEFAULT_EMBEDDING_MODEL, persist: bool = True
+) -> EmbeddingService:
+    """Process-wide `EmbeddingService` for ``model_name``, created on first use."""
+    with _services_lock:
+        service = _services.get(model_name)
+        if service is None:
+            store = None
+            if persist:
+                store = DiskCache(os.path.join(cache_dir(), "embeddings.sqlite"))
+            service = EmbeddingService(model_name, store=store)
+            _services[model_name] = service
+        return service
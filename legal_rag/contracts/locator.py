@@ -0,0 +1,311 @@
+"""
+Locate the sections of a contract without a table of contents.
+
+When the pages were extracted with their layout (the "pdfminer-outline"
+backend), `outline_index` takes the headings from the font of the lines:
+lines set larger (or bolder) than the body text form an outline, and the
+headings of its top level start the sections.
+
+Otherwise every heading of `diccionario_keywords` is compiled into an
+Aho-Corasick automaton, which finds all their occurrences in a page in a
+single scan. An occurrence counts as a heading when it starts a short line
+(after its numbering), and the first page of each heading becomes the start
+of a section of the synthesized `ContractIndex`.
+"""
+
+import logging
+import threading
+import unicodedata
+from collections import Counter, deque
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from legal_rag import tracing
+from legal_rag.contracts.parsing import ContractIndex, Section, build_contract_index
+from legal_rag.contracts.utils import diccionario_keywords
+
+# longest line (in characters) taken as a heading, body lines are longer
+MAX_HEADING_CHARS = 80
+# a page with this many headings is a table of contents (without dotted
+# leaders), its headings do not start sections
+MIN_TOC_HEADINGS = 3
+# leading characters of a heading line that are not part of the heading
+NUMBERING = "0123456789.-–)( \t"
+# name of the only section when no heading is found at all
+WHOLE_DOCUMENT = "Contrato"
+# with the layout, a line is a heading when its font is this much larger than
+# the one of the body text, or as large but bold
+HEADING_SIZE_RATIO = 1.15
+# lines that look like headings on more pages than this are running headers
+MAX_HEADING_REPEATS = 2
+# sections come from the largest heading style with at least this many
+# headings, so the title of the contract is not the only section
+MIN_OUTLINE_SECTIONS = 2
+# pages of a lazily extracted contract that the outline may extract, besides
+# those already extracted: the layout analysis of a page takes ~50 ms
+OUTLINE_PAGE_BUDGET = 60
+
+
+def normalize(text: str) -> str:
+    """Lowercase ``text`` and drop its accents (and any other non ASCII character)."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    return text.encode("ascii", "ignore").decode("ascii")
+
+
+class KeywordAutomaton:
+    """
+    Aho-Corasick automaton over the normalized ``keywords`` (variants by
+    group), finding all the occurrences of all of them in time linear in the
+    length of the text.
+    """
+
+    def __init__(self, keywords: Dict[str, Sequence[str]]):
+        # (group, normalized keyword) of each pattern
+        self.patterns: List[Tuple[str, str]] = []
+        seen = set()
+        for group, variants in keywords.items():
+            for variant in variants:
+                pattern = normalize(variant).strip()
+                if pattern and (group, pattern) not in seen:
+                    seen.add((group, pattern))
+                    self.patterns.append((group, pattern))
+
+        self._goto: List[Dict[str, int]] = [{}]
+        self._outputs: List[List[int]] = [[]]
+        for i, (_, pattern) in enumerate(self.patterns):
+            state = 0
+            for c in pattern:
+                if c not in self._goto[state]:
+                    self._goto.append({})
+                    self._outputs.append([])
+                    self._goto[state][c] = len(self._goto) - 1
+                state = self._goto[state][c]
+            self._outputs[state].append(i)
+
+        # failure links, breadth first so the links of shorter prefixes are set
+        self._fail = [0] * len(self._goto)
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for c, child in self._goto[state].items():
+                queue.append(child)
+                fail = self._fail[state]
+                while fail and c not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(c, 0)
+                self._outputs[child] = (
+                    self._outputs[child] + self._outputs[self._fail[child]]
+                )
+
+    def find(self, text: str) -> Iterator[Tuple[int, int]]:
+        """``(start, pattern)`` of every occurrence in ``text``, already normalized."""
+        goto, fail, outputs = self._goto, self._fail, self._outputs
+        state = 0
+        for end, c in enumerate(text, 1):
+            while state and c not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(c, 0)
+            for i in outputs[state]:
+                yield end - len(self.patterns[i][1]), i
+
+
+def find_headings(
+    automaton: KeywordAutomaton, page_text: str
+) -> List[Tuple[str, str, str]]:
+    """``(group, normalized heading, heading)`` of the headings of a page."""
+    text = normalize(page_text)
+    headings = []
+    for start, i in automaton.find(text):
+        group, pattern = automaton.patterns[i]
+        end = start + len(pattern)
+        # whole words only
+        if (start > 0 and text[start - 1].isalnum()) or (
+            end < len(text) and text[end].isalnum()
+        ):
+            continue
+        line_start = text.rfind("\n", 0, start) + 1
+        line_end = text.find("\n", start)
+        line = text[line_start : len(text) if line_end < 0 else line_end]
+        stripped = line.lstrip(NUMBERING)
+        if len(stripped) > MAX_HEADING_CHARS or len(line) - len(stripped) != (
+            start - line_start
+        ):
+            continue
+        # normalizing keeps the line breaks, so the line is also that of the page
+        name = page_text.split("\n")[text.count("\n", 0, start)]
+        headings.append((group, stripped.strip(), name.strip().lstrip(NUMBERING)))
+    return headings
+
+
+_automaton = None
+_automaton_lock = threading.Lock()
+
+
+def get_automaton() -> KeywordAutomaton:
+    """Automaton of `diccionario_keywords`, compiled on first use."""
+    global _automaton
+    with _automaton_lock:
+        if _automaton is None:
+            _automaton = KeywordAutomaton(diccionario_keywords)
+        return _automaton
+
+
+def keyword_starts(contrato, pages: Iterable[int]) -> Dict[str, Tuple[str, int]]:
+    """
+    Name and first page (1-based, like in an index) of the headings found in
+    ``pages``, by normalized heading.
+    """
+    # like index_parser, a cheap extraction is enough to look for headings
+    draft = getattr(contrato, "draft", contrato.__getitem__)
+    automaton = get_automaton()
+
+    starts: Dict[str, Tuple[str, int]] = {}
+    for page in pages:
+        headings = find_headings(automaton, draft(page).page_content)
+        if len({key for _, key, _ in headings}) >= MIN_TOC_HEADINGS:
+            logging.info(f"Page {page} looks like a table of contents, skipped")
+            continue
+        for _, key, name in headings:
+            starts.setdefault(key, (name, page + 1))
+    return starts
+
+
+def locate_sections(contrato) -> ContractIndex:
+    """
+    `ContractIndex` of a contract without an index, with a section from the
+    first page of each heading found to (about) the start of the next one.
+    Without any heading the whole contract is a single section.
+    """
+    n_paginas = len(contrato)
+    dict_index = dict(keyword_starts(contrato, range(n_paginas)).values())
+
+    tracing.current_span().set(toc="keywords", sections=len(dict_index))
+    if not dict_index:
+        logging.warning("No headings found, the whole contract is a single section")
+        return ContractIndex(
+            page=-1,
+            sections=[
+                Section(name=WHOLE_DOCUMENT, start_page=0, end_page=n_paginas - 1)
+            ],
+            annex_names=[],
+            contains_kpi_annex=False,
+        )
+
+    logging.info(f"Located {len(dict_index)} sections by their headings")
+    return build_contract_index(dict_index, n_paginas, -1)
+
+
+def has_layout(contrato) -> bool:
+    """Whether the pages were extracted with their layout, see `outline_index`."""
+    return len(contrato) > 0 and "layout" in contrato[0].metadata
+
+
+def outline_page_numbers(
+    contrato, max_pages: Optional[int] = None
+) -> Tuple[List[int], List[int]]:
+    """
+    Pages of the contract used by the outline and those left out: only
+    ``max_pages`` of the pages not extracted yet (see `loaders.LazyPDFPages`)
+    are used, the first ones.
+    """
+    extracted = set(contrato.page_texts()) if hasattr(contrato, "page_texts") else None
+    if max_pages is None or extracted is None:
+        return list(range(len(contrato))), []
+
+    used, skipped = [], []
+    n_new = 0
+    for i in range(len(contrato)):
+        if i in extracted:
+            used.append(i)
+        elif n_new < max_pages:
+            used.append(i)
+            n_new += 1
+        else:
+            skipped.append(i)
+    return used, skipped
+
+
+def outline_headings(
+    contrato, pages: Optional[Iterable[int]] = None
+) -> List[Tuple[int, str, float, bool]]:
+    """
+    ``(page, text, size, bold)`` of the lines whose font stands out from the
+    body text (the most common size), in document order. Only ``pages`` are
+    looked at, all of them by default.
+    """
+    char_sizes = Counter()
+    lines = []
+    for i in range(len(contrato)) if pages is None else pages:
+        page = contrato[i]
+        layout = page.metadata.get("layout")
+        if layout is None:
+            continue
+        for size, count in layout["char_sizes"].items():
+            char_sizes[float(size)] += count
+        lines.extend(
+            (page.metadata["page"], text, size, bold)
+            for text, size, bold in layout["lines"]
+        )
+    if not char_sizes:
+        return []
+
+    body_size = char_sizes.most_common(1)[0][0]
+    candidates = [
+        (page, text, size, bold)
+        for page, text, size, bold in lines
+        if any(c.isalpha() for c in text)
+        and (size >= body_size * HEADING_SIZE_RATIO or (bold and size >= body_size))
+    ]
+    pages_by_text = {}
+    for page, text, _, _ in candidates:
+        pages_by_text.setdefault(normalize(text), set()).add(page)
+    return [
+        heading
+        for heading in candidates
+        if len(pages_by_text[normalize(heading[1])]) <= MAX_HEADING_REPEATS
+    ]
+
+
+def outline_index(
+    contrato, max_pages: Optional[int] = OUTLINE_PAGE_BUDGET
+) -> ContractIndex:
+    """
+    `ContractIndex` from the headings of the layout of the pages, extracted
+    along with their text (see `loaders.backends.PDFMinerOutlineBackend`).
+    Each heading of the top level of the outline starts a section, falls
+    back to `locate_sections` when there is no such level.
+
+    Lazy pages that were not extracted yet need the full layout analysis, so
+    at most ``max_pages`` of them are (None for all of them), pages already in
+    memory are always used. The headings of the other pages are located by
+    keywords on their cheap extraction, as in `locate_sections`, so sections
+    near the end (e.g. the annexes) are not missed.
+    """
+    used, skipped = outline_page_numbers(contrato, max_pages)
+    headings = outline_headings(contrato, used)
+    styles = Counter((size, bold) for _, _, size, bold in headings)
+    levels = sorted(styles, reverse=True)
+    logging.info(f"Outline levels (size, bold): {levels}")
+    level = next((s for s in levels if styles[s] >= MIN_OUTLINE_SECTIONS), None)
+    if level is None:
+        logging.warning("No outline in the layout, locating the sections by keywords")
+        return locate_sections(contrato)
+
+    dict_index = {}
+    for page, text, size, bold in headings:
+        if (size, bold) == level:
+            dict_index.setdefault(text, page + 1)
+
+    if skipped:
+        logging.warning(
+            f"Outline limited to {len(contrato) - len(skipped)} of {len(contrato)}"
+            " pages, locating the sections of the others by keywords"
+        )
+        outlined = [normalize(name) for name in dict_index]
+        for key, (name, page) in keyword_starts(contrato, skipped).items():
+            if not any(key in heading for heading in outlined):
+                dict_index.setdefault(name, page)
+        dict_index = dict(sorted(dict_index.items(), key=lambda item: item[1]))
+
+    tracing.current_span().set(toc="outline", sections=len(dict_index))
+    logging.info(f"Found {len(dict_index)} sections in the outline")
+    return build_contract_index(dict_index, len(contrato), -1)
@@ -1,7 +1,9 @@
 import logging
+from bisect import bisect_right
+from itertools import accumulate
 from typing import List
 
-from demo.contracts.utils import diccionario_keywords
+from legal_rag.contracts.utils import diccionario_keywords
 from pydantic import BaseModel
 from unidecode import unidecode
 
@@ -19,109 +21,120 @@ class ContractIndex(BaseModel):
     contains_kpi_annex: bool
 
 
+class IndexNotFoundError(ValueError):
+    """The contract has no table of contents with dotted leaders."""
+
+
 nombres_especificaciones = ["especificaciones del contrato", "contract specifics"]
 
 
+def clean_line(line: str) -> str:
+    """A line of the index without its numbering, surrounding dots and whitespace."""
+    return line.lstrip("0123456789").strip().strip(".").strip("\n").rstrip()
+
+
+def is_index_title(line: str) -> bool:
+    return unidecode(line).lower().startswith(("indice", "contenido"))
+
+
 def clean_lines(lines):
-    # remove leading digits
-    lines = [line.lstrip("0123456789") for line in lines]
-    # lstrip whitespaces and \n
-    lines = [line.lstrip().rstrip() for line in lines]
-    lines = [line.strip(".") for line in lines]
-    lines = [line.strip("\n") for line in lines]
-    # rstrip whitespaces
-    lines = [line.rstrip() for line in lines]
-    # if a line is empty, remove it
-    lines = [line for line in lines if line != ""]
-    # if a line is just a number, remove it
-    lines = [line for line in lines if not line.isdigit()]
-    # if a line startswith indice or index, remove it
-    lines = [line for line in lines if not unidecode(line).lower().startswith("indice")]
-    lines = [
-        line for line in lines if not unidecode(line).lower().startswith("contenido")
+    lines = [clean_line(line) for line in lines]
+    # remove empty lines, page numbers and the title of the index
+    return [
+        line
+        for line in lines
+        if line != "" and not line.isdigit() and not is_index_title(line)
     ]
-    return lines
+
+
+def parse_index_line(line: str):
+    """
+    The ``(name, page)`` of an index entry, e.g. ``"2. Alcance ........ 5"``,
+    or None if the line has no dotted leader. ``page`` is the text after the
+    leader and may not be a number.
+    """
+    line = clean_line(line)
+    # lines without a leader are not entries, that is checked first as it is
+    # the cheapest test and most lines of the index pages fail it
+    if "..." not in line or is_index_title(line):
+        return None
+
+    # the last dot ends the leader, the other dots are dropped
+    last_dot = line.rfind(".")
+    index_name = line[:last_dot].replace(".", "")
+    page = line[last_dot + 1 :].replace(".", "")
+    if "[END]" in index_name or "[END]" in page:
+        # [END] used to mark the end of the leader, entries with the marker
+        # in their text are still rejected
+        logging.warning(f"{line}")
+        raise ValueError("No se pudo separar el indice de la pagina")
+    index_name = index_name.strip().lstrip("0123456789").strip()
+    page = page.replace(" ", "").strip()
+    return index_name, page
 
 
 def index_parser(contrato) -> dict:
     n_paginas = len(contrato)
 
-    def add_end_token(lines):
-        for i, line in enumerate(lines):
-            if "..." in line:
-                # go to last dot
-                last_dot = line.rfind(".")
-                # replace this dot by END
-                line = line[:last_dot] + "[END]" + line[last_dot + 1 :]
-                # replace all dots by ""
-                line = line.replace(".", "")
-                lines[i] = line
-            else:
-                lines[i] = ""
-        return [line for line in lines if line != ""]
+    # pages that can give a cheap extraction (see loaders.LazyPDFPages.draft)
+    # are only fully extracted when they do contain the index
+    draft = getattr(contrato, "draft", contrato.__getitem__)
 
     pages_with_index = []
+    entries = []
     for i in range(0, n_paginas // 4):
-        if "..." in contrato[i].page_content:
+        if "..." in draft(i).page_content:
             logging.info(f"Page {i} has index")
-            pages_with_index.append(contrato[i])
+            page_as_doc = contrato[i]
+            pages_with_index.append(page_as_doc)
+            for line in page_as_doc.page_content.split("\n\n"):
+                entry = parse_index_line(line)
+                # check if index_name is not empty
+                if entry is not None and entry[0] != "" and entry[1].isdigit():
+                    entries.append(entry)
+        elif len(entries) > 0:
+            # the index is contiguous: once some of its entries were read, no
+            # need to read (and extract) more pages. Pages with "..." before
+            # it (e.g. a cover with an ellipsis) do not stop the scan
+            break
 
     if len(pages_with_index) == 0:
-        raise ValueError("No se pudo encontrar el indice")
+        raise IndexNotFoundError("No se pudo encontrar el indice")
     else:
         index_start_page = pages_with_index[0].metadata["page"]
         index_last_page = pages_with_index[-1].metadata["page"]
 
-    for i, page_as_doc in enumerate(pages_with_index):
-        page_str = page_as_doc.page_content
-
-        lines = page_str.split("\n\n")
-        lines = clean_lines(lines)
-        # in each line if line contains a set of dots, replace the dots by -
-        lines = add_end_token(lines)
-        pages_with_index[i] = lines
-
+    # the only state is the page offset set by the first section
     dict_index = {}
     page_delta = 0
-    for lines in pages_with_index:
-        for line in lines:
-            try:
-                # separate by END
-                index_name, page = "".join(line).split("[END]")
-            except ValueError:
-                logging.warning(f"{line}")
-                raise ValueError("No se pudo separar el indice de la pagina")
-            index_name = index_name.rstrip().lstrip()
-
-            page = page.replace("[END]", "")
-            page = page.replace(" ", "")
-            page = page.rstrip().lstrip()
-
-            # check if starts with a number
-            while index_name.startswith(tuple("0123456789")):
-                index_name = index_name[1:]
-
-            index_name = index_name.rstrip().lstrip()
-
-            # check if index_name is not empty
-            if index_name != "" and page.isdigit():
-                # esto es ya que puede ser que la especificaciones,
-                # que deberia la primera seccion, no este bien numerado
-                if index_name.lower() in nombres_especificaciones and page == "1":
-                    page_delta = index_last_page + 1
-
-                dict_index[index_name] = int(page) + page_delta
-
-    sections = []
-    for key, value in dict_index.items():
-        sections.append(
-            Section(
-                name=key,
-                start_page=value - 1,
-                end_page=get_page_end(value, dict_index, n_paginas),
-            )
+    for index_name, page in entries:
+        # esto es ya que puede ser que la especificaciones,
+        # que deberia la primera seccion, no este bien numerado
+        if index_name.lower() in nombres_especificaciones and page == "1":
+            page_delta = index_last_page + 1
+
+        dict_index[index_name] = int(page) + page_delta
+
+    if not dict_index:
+        # e.g. text extracted without the paragraph breaks between entries
+        raise IndexNotFoundError(
+            f"No se encontraron secciones en el indice (paginas {index_start_page}-{index_last_page})"
         )
 
+    return build_contract_index(dict_index, n_paginas, index_start_page)
+
+
+def build_contract_index(dict_index, n_paginas, index_page) -> ContractIndex:
+    """
+    `ContractIndex` of the sections in ``dict_index``, by name, with the
+    (1-based) page where they start, in the order of the index.
+    """
+    page_ends = page_end_finder(dict_index.values(), n_paginas)
+    sections = [
+        Section(name=key, start_page=value - 1, end_page=page_ends(value))
+        for key, value in dict_index.items()
+    ]
+
     # Check if any section.name is within annex_kws
     annex_kws = {"anexo", "schedule", "annex"}
     annex_names = []
@@ -142,25 +155,60 @@ def index_parser(contrato) -> dict:
     # for all annex_names, if any of them contains any kpis_kws as substring
     contains_kpi_annex = False
     for annex_name in annex_names:
-        print(annex_name, kpis_kws)
+        logging.debug(f"Looking for KPI keywords in {annex_name}")
         if any(kw in annex_name.lower() for kw in kpis_kws):
             contains_kpi_annex = True
             break
 
     return ContractIndex(
-        page=index_start_page,
+        page=index_page,
         sections=sections,
         annex_names=list(annex_names) if len(annex_names) > 0 else [],
         contains_kpi_annex=contains_kpi_annex,
     )
 
 
+def parse_contract_index(contrato) -> ContractIndex:
+    """
+    `index_parser`, falling back to the headings of the layout (see
+    `locator.outline_index`), or of the keywords (`locator.locate_sections`)
+    without it, when the contract has no index.
+    """
+    try:
+        return index_parser(contrato)
+    except IndexNotFoundError:
+        from legal_rag.contracts.locator import (
+            has_layout,
+            locate_sections,
+            outline_index,
+        )
+
+        if has_layout(contrato):
+            logging.warning("No index found, using the outline of the layout")
+            return outline_index(contrato)
+        logging.warning("No index found, locating the sections by their headings")
+        return locate_sections(contrato)
+
+
 # Va agregar 4 paginas extras las necesite o no, a priori se considera que siempre la page_start es menor o igual a la pagina de inicio correcta
 def get_page_end(page_start, doc_index, cantidad_paginas):
-    for page in doc_index.values():
-        if page > page_start:
-            if page + 4 >= cantidad_paginas:
-                return cantidad_paginas - 1
-            return page + 4
-    # Si no hay seccion que termine despues de la page_start, entonces es la ultima seccion y su end_page es la ultima pagina
-    return cantidad_paginas - 1
+    return page_end_finder(doc_index.values(), cantidad_paginas)(page_start)
+
+
+def page_end_finder(pages, cantidad_paginas):
+    """
+    `get_page_end` for many sections of the same index: the end of a section
+    comes from the first page of the index (in index order) after its start,
+    which is found with a bisect over the running maximum of the pages.
+    """
+    pages = list(pages)
+    running_max = list(accumulate(pages, max))
+
+    def page_end(page_start):
+        i = bisect_right(running_max, page_start)
+        if i == len(pages):
+            # Si no hay seccion que termine despues de la page_start, entonces es la ultima seccion y su end_page es la ultima pagina
+            return cantidad_paginas - 1
+        return min(pages[i] + 4, cantidad_paginas - 1)
+
+    return page_end
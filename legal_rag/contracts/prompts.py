@@ -1,10 +1,22 @@
-from dataclasses import dataclass
+import logging
+from dataclasses import dataclass, field
 from typing import List
 
 from langchain.prompts import PromptTemplate
+from legal_rag import tracing
+from legal_rag.contracts.retrieval import retrieve_chunks
+from legal_rag.contracts.tokens import TokenCounter, get_token_counter
+from legal_rag.models.oai import (
+    DEFAULT_MODEL_NAME,
+    MAX_COMPLETION_TOKENS,
+    USER_MESSAGE,
+    model_token_limit,
+)
 from llama_index import Document
 
 TRUNCATE = 8192
+# chat format tokens added around every message
+MESSAGE_OVERHEAD_TOKENS = 4
 
 
 @dataclass
@@ -13,6 +25,10 @@ class Context:
     str_context: str
     section_name: str
     page: int
+    # pages the text in str_context comes from
+    pages_used: List[int] = field(default_factory=list)
+    # end of the section, exclusive
+    end_page: int = None
 
 
 system_prompt = """
@@ -56,32 +72,120 @@ def truncate_tokens(tokens, max_len=7192):
         return tokens[:final_max_len]
 
 
+@tracing.traced("build_context")
 def build_context(
     selected_section,
     pages,
     truncate_len=None,
     results=None,
+    selected_questions=None,
 ):
+    """
+    Build the context of the selected section.
+
+    Without ``selected_questions`` the section is truncated to fit. With them
+    the section is split in paragraphs and the budget is filled with the ones
+    that best match the questions (BM25), keeping the document order.
+    """
     context = pages[selected_section.start_page : selected_section.end_page]
-    str_context = "\n".join([page.page_content for page in context])
-    str_context = truncate_tokens(str_context, max_len=truncate_len or TRUNCATE)
+    max_len = truncate_len or TRUNCATE
+    if selected_questions is None:
+        str_context = "\n".join([page.page_content for page in context])
+        str_context = truncate_tokens(str_context, max_len=max_len)
+        pages_used, offset = [], 0
+        for page in context:
+            if offset >= len(str_context):
+                break
+            pages_used.append(page.metadata["page"])
+            offset += len(page.page_content) + 1
+    else:
+        chunks = retrieve_chunks(
+            context, selected_questions, budget=max_len - len(system_prompt)
+        )
+        str_context = " ".join(chunk.text for chunk in chunks)
+        pages_used = sorted({chunk.page for chunk in chunks})
 
+    tracing.current_span().set(
+        section=selected_section.name,
+        context_chars=len(str_context),
+        pages_used=pages_used,
+    )
     try:
         ctx = Context(
             context=context,
             str_context=str_context,
             section_name=selected_section.name,
             page=selected_section.start_page,
+            pages_used=pages_used,
+            end_page=selected_section.end_page,
         )
 
     except Exception as e:
-        print(e)
-        print(context)
-        print(len(str_context))
-        print(selected_section.name)
+        logging.error(
+            f"Could not build the context of {selected_section.name} "
+            f"({len(context)} pages, {len(str_context)} chars): {e}"
+        )
         return context, str_context, selected_section.name
 
     if results is not None and len(results) == 1:
         results[0] = ctx
 
     return ctx
+
+
+@tracing.traced("build_context")
+def assemble_context(
+    selected_section,
+    pages,
+    selected_questions,
+    extraction_prompt,
+    model_name=DEFAULT_MODEL_NAME,
+    max_context_tokens=None,
+    completion_tokens=MAX_COMPLETION_TOKENS,
+    token_counter: TokenCounter = None,
+) -> Context:
+    """
+    Build the context of the selected section within the token budget of the model.
+
+    The budget is the context window of ``model_name`` minus the formatted
+    prompt (system prompt, questions and format instructions), the user message
+    and the tokens reserved for the completion, capped at ``max_context_tokens``.
+    It is filled with whole paragraphs, the most relevant to the questions first.
+    """
+    token_counter = token_counter or get_token_counter()
+    prompt_tokens = (
+        token_counter.count(extraction_prompt.format(context=""))
+        + token_counter.count(USER_MESSAGE)
+        + 2 * MESSAGE_OVERHEAD_TOKENS
+    )
+    budget = model_token_limit(model_name) - prompt_tokens - completion_tokens
+    if max_context_tokens is not None:
+        budget = min(budget, max_context_tokens)
+    if budget <= 0:
+        raise ValueError(
+            f"The prompt ({prompt_tokens} tokens) leaves no room for context in {model_name}"
+        )
+
+    context = pages[selected_section.start_page : selected_section.end_page]
+    # every chunk is joined with a separator
+    costs = [count + 1 for count in token_counter.chunk_counts(context)]
+    chunks = retrieve_chunks(context, selected_questions, budget, costs=costs)
+    used = sum(costs[chunk.order] for chunk in chunks)
+    logging.info(f"Context of {len(chunks)} chunks, {used} of {budget} tokens")
+    str_context = " ".join(chunk.text for chunk in chunks)
+    tracing.current_span().set(
+        section=selected_section.name,
+        chunks=len(chunks),
+        context_chars=len(str_context),
+        tokens_used=used,
+        token_budget=budget,
+    )
+
+    return Context(
+        context=context,
+        str_context=str_context,
+        section_name=selected_section.name,
+        page=selected_section.start_page,
+        pages_used=sorted({chunk.page for chunk in chunks}),
+        end_page=selected_section.end_page,
+    )
@@ -0,0 +1,162 @@
+"""BM25 retrieval of the most relevant paragraphs inside a contract section."""
+
+import math
+import re
+from collections import Counter
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import List, Optional, Sequence
+
+import numpy as np
+from unidecode import unidecode
+
+PARAGRAPH_SEP = re.compile(r"\n\s*\n")
+TOKEN = re.compile(r"\w\w+")
+
+
+@dataclass
+class Chunk:
+    text: str
+    page: int
+    # position of the chunk in the document, to restore the reading order
+    order: int
+
+
+@lru_cache(maxsize=1 << 16)
+def _fold_accents(token: str) -> str:
+    return unidecode(token)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased words without accents, unidecode only runs on non-ascii words."""
+    return [
+        token if token.isascii() else _fold_accents(token)
+        for token in TOKEN.findall(text.lower())
+    ]
+
+
+def split_paragraph(paragraph: str, max_chars: int) -> List[str]:
+    """Split a paragraph longer than ``max_chars`` at whitespace."""
+    if len(paragraph) <= max_chars:
+        return [paragraph]
+
+    parts, start = [], 0
+    while start < len(paragraph):
+        end = start + max_chars
+        if end < len(paragraph):
+            space = paragraph.rfind(" ", start, end)
+            end = space if space > start else end
+        parts.append(paragraph[start:end].strip())
+        start = end
+    return [part for part in parts if part != ""]
+
+
+def chunk_text(text: str, max_chars: int = 1000) -> List[str]:
+    """
+    Paragraph-sized chunks of a page, pdfminer separates the text boxes
+    of a page with a blank line.
+    """
+    chunks = []
+    for paragraph in PARAGRAPH_SEP.split(text):
+        paragraph = " ".join(paragraph.split())
+        chunks.extend(split_paragraph(paragraph, max_chars))
+    return chunks
+
+
+def chunk_pages(pages: Sequence, max_chars: int = 1000) -> List[Chunk]:
+    chunks = []
+    for page in pages:
+        for text in chunk_text(page.page_content, max_chars):
+            chunks.append(
+                Chunk(text=text, page=page.metadata["page"], order=len(chunks))
+            )
+    return chunks
+
+
+class BM25Index:
+    """Okapi BM25 over a small in-memory collection, kept as an inverted index."""
+
+    def __init__(
+        self, documents: Sequence[List[str]], k1: float = 1.5, b: float = 0.75
+    ):
+        self.n_docs = len(documents)
+        lengths = np.array([len(doc) for doc in documents], dtype=float)
+        avg_length = lengths.mean() if self.n_docs > 0 else 0.0
+        # per document length normalization of the term frequencies
+        self._norm = k1 * (1 - b + b * lengths / max(avg_length, 1e-9))
+        self._k1 = k1
+
+        postings = {}
+        for doc_id, doc in enumerate(documents):
+            for term, tf in Counter(doc).items():
+                postings.setdefault(term, ([], []))
+                postings[term][0].append(doc_id)
+                postings[term][1].append(tf)
+
+        self._postings = {}
+        for term, (doc_ids, tfs) in postings.items():
+            df = len(doc_ids)
+            idf = math.log((self.n_docs - df + 0.5) / (df + 0.5) + 1)
+            self._postings[term] = (np.array(doc_ids), np.array(tfs, dtype=float), idf)
+
+    def scores(self, query: List[str]) -> np.ndarray:
+        scores = np.zeros(self.n_docs)
+        for term, qf in Counter(query).items():
+            if term not in self._postings:
+                continue
+            doc_ids, tfs, idf = self._postings[term]
+            scores[doc_ids] += (
+                qf * idf * tfs * (self._k1 + 1) / (tfs + self._norm[doc_ids])
+            )
+        return scores
+
+
+def question_query(selected_questions) -> List[str]:
+    """Query terms of a question set: its name, description, template and prompt."""
+    fields = [
+        selected_questions.name,
+        selected_questions.description,
+        selected_questions.answer_template,
+        selected_questions.prompt,
+    ]
+    return tokenize(" ".join(field for field in fields if field))
+
+
+def select_chunks(
+    chunks: List[Chunk],
+    scores: np.ndarray,
+    budget: int,
+    costs: Optional[Sequence[int]] = None,
+) -> List[Chunk]:
+    """
+    Best scoring chunks that fit in ``budget``, returned in document order.
+    Chunks are taken by decreasing score (ties in document order), skipping
+    those that do not fit anymore. ``costs`` defaults to the characters of
+    each chunk plus a separator.
+    """
+    if costs is None:
+        costs = [len(chunk.text) + 1 for chunk in chunks]
+
+    selected, used = [], 0
+    for idx in np.argsort(-scores, kind="stable"):
+        if used + costs[idx] <= budget:
+            selected.append(chunks[idx])
+            used += costs[idx]
+    return sorted(selected, key=lambda chunk: chunk.order)
+
+
+def retrieve_chunks(
+    pages: Sequence,
+    selected_questions,
+    budget: int,
+    costs: Optional[Sequence[int]] = None,
+) -> List[Chunk]:
+    """
+    Fill ``budget`` with the paragraphs of ``pages`` most relevant to the questions.
+    The budget is in characters unless ``costs`` gives the cost of every chunk
+    (in the order of `chunk_pages`).
+    """
+    chunks = chunk_pages(pages)
+    index = BM25Index([tokenize(chunk.text) for chunk in chunks])
+    scores = index.scores(question_query(selected_questions))
+    return select_chunks(chunks, scores, budget, costs=costs)
@@ -0,0 +1,117 @@
+"""Token counting for context budgets."""
+
+import abc
+import math
+import re
+import threading
+from collections import OrderedDict
+from typing import List, Sequence
+
+from legal_rag.contracts.retrieval import chunk_text
+
+WORD_OR_SYMBOL = re.compile(r"\w+|[^\w\s]")
+
+
+class Tokenizer(abc.ABC):
+    name: str = None
+
+    @abc.abstractmethod
+    def count(self, text: str) -> int:
+        """Number of tokens of ``text``."""
+
+
+class EstimatingTokenizer(Tokenizer):
+    """
+    Offline estimate of the token count: a token per ``chars_per_token``
+    characters of every word (at least one) plus a token per symbol.
+    BPE tokenizers split Spanish words more than English ones, the default
+    errs on the side of overestimating.
+    """
+
+    name = "estimate"
+
+    def __init__(self, chars_per_token: float = 3.5):
+        self.chars_per_token = chars_per_token
+
+    def count(self, text: str) -> int:
+        return sum(
+            math.ceil(len(token) / self.chars_per_token)
+            for token in WORD_OR_SYMBOL.findall(text)
+        )
+
+
+class TiktokenTokenizer(Tokenizer):
+    """Exact counts for OpenAI models, requires `tiktoken`."""
+
+    def __init__(self, model_name: str):
+        try:
+            import tiktoken
+        except ImportError:
+            raise ImportError(
+                "tiktoken is required to count tokens: `pip install tiktoken`"
+            )
+
+        self.name = f"tiktoken:{model_name}"
+        self.encoding = tiktoken.encoding_for_model(model_name)
+
+    def count(self, text: str) -> int:
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+
+def get_tokenizer(
+    name: str = EstimatingTokenizer.name, model_name: str = None
+) -> Tokenizer:
+    if name == EstimatingTokenizer.name:
+        return EstimatingTokenizer()
+    if name == "tiktoken":
+        return TiktokenTokenizer(model_name)
+    raise ValueError(f"Tokenizer {name} not supported")
+
+
+class TokenCounter:
+    """
+    Counts tokens with a `Tokenizer`, keeping the counts of the chunks of every
+    page it has seen so assembling another context from the same pages is cheap.
+    """
+
+    def __init__(self, tokenizer: Tokenizer = None, max_pages: int = 4096):
+        self.tokenizer = tokenizer or EstimatingTokenizer()
+        self.max_pages = max_pages
+        self._page_counts: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def count(self, text: str) -> int:
+        return self.tokenizer.count(text)
+
+    def page_chunk_counts(self, page) -> List[int]:
+        """Token counts of the chunks of a page (see `retrieval.chunk_text`)."""
+        text = page.page_content
+        with self._lock:
+            counts = self._page_counts.get(text)
+            if counts is not None:
+                self._page_counts.move_to_end(text)
+                return counts
+
+        counts = [self.count(chunk) for chunk in chunk_text(text)]
+        with self._lock:
+            self._page_counts[text] = counts
+            if len(self._page_counts) > self.max_pages:
+                self._page_counts.popitem(last=False)
+        return counts
+
+    def chunk_counts(self, pages: Sequence) -> List[int]:
+        """Token counts of all the chunks of ``pages``, in the order of `retrieval.chunk_pages`."""
+        return [count for page in pages for count in self.page_chunk_counts(page)]
+
+
+_token_counters = {}
+
+
+def get_token_counter(
+    name: str = EstimatingTokenizer.name, model_name: str = None
+) -> TokenCounter:
+    """Process-wide `TokenCounter` per tokenizer, so the page counts are shared."""
+    key = (name, model_name)
+    if key not in _token_counters:
+        _token_counters[key] = TokenCounter(get_tokenizer(name, model_name=model_name))
+    return _token_counters[key]
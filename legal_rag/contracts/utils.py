@@ -1,9 +1,14 @@
 import logging
-from typing import Dict, Sequence, Union
+from typing import Dict, List, Optional, Sequence, Union
 
 import numpy as np
 import textdistance
-from sentence_transformers import SentenceTransformer, util
+from legal_rag import tracing
+from legal_rag.contracts.embeddings import (
+    DEFAULT_EMBEDDING_MODEL,
+    get_embedding_service,
+)
+from sentence_transformers import util
 
 diccionario_keywords = {
     "Alcance de Servicios": [
@@ -44,18 +49,107 @@ def get_similarity(
         util.pytorch_cos_sim if criteria == "semantica" else textdistance.Cosine()
     )
 
-    if criteria == "semantica":
-        model = (
-            SentenceTransformer("hiiamsid/sentence_similarity_spanish_es")
-            if model is None
-            else model
-        )
+    if criteria == "semantica" and model is not None:
         a = model.encode(a, convert_to_tensor=True)
         b = model.encode(b, convert_to_tensor=True)
+    elif criteria == "semantica":
+        # the shared service keeps the model loaded and memoizes the titles
+        service = get_embedding_service()
+        a = service.encode_titles([a] if isinstance(a, str) else a)
+        b = service.encode_titles([b] if isinstance(b, str) else b)
 
     return criterion(a, b)
 
 
+def warmup_semantic_selection(model_name: str = DEFAULT_EMBEDDING_MODEL):
+    """Load the embedding model and the keyword embeddings ahead of the first query."""
+    get_embedding_service(model_name).warmup(diccionario_keywords)
+
+
+def char_ngram_counts(
+    texts: Sequence[str], vocabulary: Dict[str, int], qval: int = 1
+) -> np.ndarray:
+    """Count matrix (texts x vocabulary) of the character n-grams of each text."""
+    counts = np.zeros((len(texts), len(vocabulary)), dtype=np.int32)
+    for i, text in enumerate(texts):
+        for j in range(len(text) - qval + 1):
+            counts[i, vocabulary[text[j : j + qval]]] += 1
+    return counts
+
+
+def lexical_similarity_matrix(
+    a: Sequence[str], b: Sequence[str], qval: int = 1
+) -> np.ndarray:
+    """
+    Similarity of every string in ``a`` with every string in ``b``.
+
+    Same values as ``textdistance.Cosine(qval)`` on each pair (the Ochiai
+    coefficient of the n-gram multisets), computed at once from the n-gram
+    count matrices of both lists.
+    """
+    vocabulary = {}
+    for text in (*a, *b):
+        for j in range(len(text) - qval + 1):
+            vocabulary.setdefault(text[j : j + qval], len(vocabulary))
+
+    counts_a = char_ngram_counts(a, vocabulary, qval=qval)
+    counts_b = char_ngram_counts(b, vocabulary, qval=qval)
+
+    # size of the multiset intersection of every pair: (len(a), len(b))
+    intersection = np.minimum(counts_a[:, None, :], counts_b[None, :, :]).sum(axis=-1)
+    norm = np.sqrt(np.outer(counts_a.sum(axis=1), counts_b.sum(axis=1)).astype(float))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        similarity = np.where(norm > 0, intersection / norm, 0.0)
+
+    # textdistance shortcuts: equal strings are 1, an empty string is 0
+    a_arr = np.asarray(a, dtype=object)[:, None]
+    b_arr = np.asarray(b, dtype=object)[None, :]
+    similarity[a_arr == b_arr] = 1.0
+    return similarity
+
+
+def select_index_sections(
+    raw_sections: List[Dict[str, str]],
+    q_set_names: Optional[Sequence[str]] = None,
+    criteria="lexico",
+) -> Dict[str, Dict[str, str]]:
+    """
+    Select the section of the document index for several question sets at once.
+
+    With the lexical criteria the similarity of every section name against the
+    keywords of all the question sets is computed in a single matrix, so a
+    document is routed to all of them in one shot.
+    """
+    q_set_names = list(diccionario_keywords) if q_set_names is None else q_set_names
+    if criteria != "lexico":
+        return {
+            q_set_name: select_index_section(raw_sections, q_set_name, criteria=criteria)
+            for q_set_name in q_set_names
+        }
+
+    keywords = list(
+        dict.fromkeys(
+            pos_name.lower()
+            for q_set_name in q_set_names
+            for pos_name in diccionario_keywords[q_set_name]
+        )
+    )
+    columns = {keyword: j for j, keyword in enumerate(keywords)}
+    name_raw_sections = [sec["name"].lower() for sec in raw_sections]
+    similarity = lexical_similarity_matrix(name_raw_sections, keywords)
+
+    selected = {}
+    for q_set_name in q_set_names:
+        query_idx = [
+            columns[pos_name.lower()] for pos_name in diccionario_keywords[q_set_name]
+        ]
+        result = similarity[:, query_idx].mean(axis=1)
+        selected[q_set_name] = raw_sections[result.argmax()]
+        logging.info(f"Most likely section for {q_set_name}: {selected[q_set_name]}")
+    return selected
+
+
+@tracing.traced("select_section")
 def select_index_section(
     raw_sections: Dict[str, str], q_set_name: str, criteria="lexico"
 ) -> str:
@@ -73,22 +167,23 @@ def select_index_section(
     # A continuacion buscamos usando los posibles nombres de seccion, la seccion del documento que mejor matchee
 
     if criteria == "semantica":
-        result = get_similarity("semantica", query_names, name_raw_sections).mean(dim=0)
+        service = get_embedding_service()
+        result = util.pytorch_cos_sim(
+            service.keyword_embeddings(q_set_name, query_names),
+            service.encode_titles(name_raw_sections),
+        ).mean(dim=0)
         selected_idx = result.argmax().item()
 
     elif criteria == "lexico":
-        result = np.mean(
-            [
-                [get_similarity("lexico", q, v) for q in query_names]
-                for v in name_raw_sections
-            ],
-            axis=1,
-        )
+        result = lexical_similarity_matrix(name_raw_sections, query_names).mean(axis=1)
         selected_idx = result.argmax()
     else:
         raise ValueError(f"Criteria {criteria} not supported")
 
-    to_log = [(result, s_name) for s_name in name_raw_sections]
+    tracing.current_span().set(
+        question_set=q_set_name, criteria=criteria, sections=len(raw_sections)
+    )
+    to_log = [(float(score), s_name) for score, s_name in zip(result, name_raw_sections)]
     logging.info(f"Similarity: {to_log}")
     most_likely_section = raw_sections[selected_idx]
 
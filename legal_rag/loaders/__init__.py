@@ -1 +1 @@
-from .pdfminer import parse_pdf
+from .pdfminer import extracted_page_count, parse_pdf, update_parsed_pdf_cache
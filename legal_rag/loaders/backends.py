@@ -0,0 +1,306 @@
+"""Text extraction backends for PDF files held in memory."""
+
+import abc
+import io
+from collections import Counter
+from typing import Dict, List, Optional, Tuple, Type
+
+# fonts whose name has any of these are taken as bold
+BOLD_FONT_MARKERS = ("bold", "black", "heavy")
+# lines longer than this are never headings, their style is not kept
+MAX_HEADING_CHARS = 80
+
+
+class PDFMinerExtractionSession:
+    """
+    Text extraction state shared by all the pages of a document.
+
+    pdfminer caches fonts and CMaps in its resource manager, so building one per
+    page re-parses the same embedded fonts over and over. A session keeps a single
+    resource manager, converter and interpreter for the whole document and only
+    resets the output buffer between pages.
+
+    With ``layout=False`` the layout analysis is skipped entirely: the text comes
+    out in content-stream order, without line or paragraph breaks.
+    """
+
+    def __init__(self, layout: bool = True):
+        try:
+            from pdfminer.converter import TextConverter
+            from pdfminer.layout import LAParams
+            from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+
+        except ImportError:
+            raise ImportError(
+                "pdfminer.six is required to read PDF files: `pip install pdfminer.six`"
+            )
+
+        self.laparams = LAParams() if layout else None
+        self.resource_manager = PDFResourceManager(caching=True)
+        self.output_string = io.StringIO()
+        self.device = TextConverter(
+            self.resource_manager,
+            self.output_string,
+            codec="utf-8",
+            laparams=self.laparams,
+        )
+        self.interpreter = PDFPageInterpreter(self.resource_manager, self.device)
+
+    def extract(self, page) -> str:
+        """Run the layout analysis on a page and return its text."""
+        self.output_string.seek(0)
+        self.output_string.truncate(0)
+        self.interpreter.process_page(page)
+        return self.output_string.getvalue()
+
+    def close(self):
+        self.device.close()
+        self.output_string.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class PDFMinerOutlineSession:
+    """
+    Like `PDFMinerExtractionSession` (with layout), but the layout objects of
+    each page are kept: the text is rendered from them exactly as pdfminer's
+    `TextConverter` does, and in the same walk the font size and boldness of
+    every text line are recorded, so headings can be told from body text.
+    """
+
+    def __init__(self):
+        try:
+            from pdfminer.converter import PDFPageAggregator
+            from pdfminer.layout import LAParams
+            from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+
+        except ImportError:
+            raise ImportError(
+                "pdfminer.six is required to read PDF files: `pip install pdfminer.six`"
+            )
+
+        self.laparams = LAParams()
+        self.resource_manager = PDFResourceManager(caching=True)
+        self.device = PDFPageAggregator(self.resource_manager, laparams=self.laparams)
+        self.interpreter = PDFPageInterpreter(self.resource_manager, self.device)
+
+    def extract(self, page) -> Tuple[str, Dict]:
+        """
+        Text of a page and its layout: ``{"lines": [[text, size, bold], ...],
+        "char_sizes": {size: count}}``, with the style of its short lines and
+        how many characters of each size it has.
+        """
+        from pdfminer.layout import LTChar, LTContainer, LTText, LTTextBox, LTTextLine
+
+        self.interpreter.process_page(page)
+        ltpage = self.device.get_result()
+
+        parts: List[str] = []
+        lines = []
+        char_sizes = Counter()
+
+        # same rendering as TextConverter.receive_layout
+        def render(item):
+            if isinstance(item, LTContainer):
+                start = len(parts)
+                for child in item:
+                    render(child)
+                if isinstance(item, LTTextLine):
+                    line_sizes = Counter()
+                    bold = True
+                    for child in item:
+                        if isinstance(child, LTChar) and not child.get_text().isspace():
+                            line_sizes[round(child.size, 1)] += 1
+                            fontname = child.fontname.lower()
+                            bold = bold and any(
+                                m in fontname for m in BOLD_FONT_MARKERS
+                            )
+                    char_sizes.update(line_sizes)
+                    text = "".join(parts[start:]).strip()
+                    if line_sizes and len(text) <= MAX_HEADING_CHARS:
+                        size = line_sizes.most_common(1)[0][0]
+                        lines.append([text, size, bold])
+            elif isinstance(item, LTText):
+                parts.append(item.get_text())
+            if isinstance(item, LTTextBox):
+                parts.append("\n")
+
+        render(ltpage)
+        parts.append("\f")
+        layout = {"lines": lines, "char_sizes": dict(char_sizes)}
+        return "".join(parts), layout
+
+    def close(self):
+        self.device.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ExtractionBackend(abc.ABC):
+    """
+    Extracts the text of the pages of one PDF document.
+
+    Backends are opened over the raw bytes of the document, report its number
+    of pages and extract single pages on demand, which is all the loaders need.
+    """
+
+    name: str = None
+
+    def __init__(self, bytes_data: bytes):
+        self.bytes_data = bytes_data
+
+    @abc.abstractmethod
+    def __len__(self) -> int:
+        """Number of pages in the document."""
+
+    @abc.abstractmethod
+    def extract(self, i: int) -> str:
+        """Text of the (0-based) page ``i``."""
+
+    @classmethod
+    def version(cls) -> str:
+        """Identifies the backend and its settings, changes when the output may change."""
+        return cls.name
+
+    def page_layout(self, i: int) -> Optional[Dict]:
+        """Layout of page ``i`` once extracted, for the backends that keep one."""
+        return None
+
+    def close(self):
+        pass
+
+
+class PDFMinerBackend(ExtractionBackend):
+    """pdfminer.six with the default layout analysis (slowest, best text)."""
+
+    name = "pdfminer"
+    layout = True
+
+    def __init__(self, bytes_data: bytes):
+        from pdfminer.pdfpage import PDFPage
+
+        super().__init__(bytes_data)
+        self._pdf_pages = list(PDFPage.get_pages(io.BytesIO(bytes_data)))
+        self._session = None
+
+    def __len__(self) -> int:
+        return len(self._pdf_pages)
+
+    def extract(self, i: int) -> str:
+        if self._session is None:
+            self._session = PDFMinerExtractionSession(layout=self.layout)
+        return self._session.extract(self._pdf_pages[i])
+
+    @classmethod
+    def version(cls) -> str:
+        import pdfminer
+        from pdfminer.layout import LAParams
+
+        laparams = LAParams() if cls.layout else None
+        return f"{cls.name}:{pdfminer.__version__}:{laparams!r}"
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+
+class PDFMinerNoLayoutBackend(PDFMinerBackend):
+    """pdfminer.six without layout analysis, text has no line breaks."""
+
+    name = "pdfminer-nolayout"
+    layout = False
+
+
+class PDFMinerOutlineBackend(PDFMinerBackend):
+    """
+    pdfminer.six with layout analysis, same text as "pdfminer", that also
+    keeps the font size and boldness of the lines of each page, used to find
+    the sections of contracts without an index.
+    """
+
+    name = "pdfminer-outline"
+
+    def __init__(self, bytes_data: bytes):
+        super().__init__(bytes_data)
+        self._layouts: Dict[int, Dict] = {}
+
+    def extract(self, i: int) -> str:
+        if self._session is None:
+            self._session = PDFMinerOutlineSession()
+        text, self._layouts[i] = self._session.extract(self._pdf_pages[i])
+        return text
+
+    def page_layout(self, i: int) -> Optional[Dict]:
+        return self._layouts.get(i)
+
+
+class PyPDFBackend(ExtractionBackend):
+    """pypdf's text extraction, the cheapest option."""
+
+    name = "pypdf"
+
+    def __init__(self, bytes_data: bytes):
+        try:
+            from pypdf import PdfReader
+        except ImportError:
+            raise ImportError(
+                "pypdf is required to read PDF files: `pip install pypdf`"
+            )
+
+        super().__init__(bytes_data)
+        self._reader = PdfReader(io.BytesIO(bytes_data))
+
+    def __len__(self) -> int:
+        return len(self._reader.pages)
+
+    def extract(self, i: int) -> str:
+        return self._reader.pages[i].extract_text()
+
+    @classmethod
+    def version(cls) -> str:
+        import pypdf
+
+        return f"{cls.name}:{pypdf.__version__}"
+
+
+BACKENDS: Dict[str, Type[ExtractionBackend]] = {
+    backend.name: backend
+    for backend in (
+        PDFMinerBackend,
+        PDFMinerNoLayoutBackend,
+        PDFMinerOutlineBackend,
+        PyPDFBackend,
+    )
+}
+
+# "auto" detects the index with the cheap backend and extracts
+# the pages that are sent to the LLM with the full layout one
+AUTO_BACKEND = "auto"
+AUTO_DRAFT_BACKEND = PyPDFBackend.name
+AUTO_FULL_BACKEND = PDFMinerBackend.name
+# cheap backend that the index and the headings of the pages are looked for
+# with (see `LazyPDFPages.draft`), before the pages are fully extracted
+DRAFT_BACKENDS = {
+    AUTO_BACKEND: AUTO_DRAFT_BACKEND,
+    PDFMinerOutlineBackend.name: PyPDFBackend.name,
+}
+
+
+def get_backend(name: str) -> Type[ExtractionBackend]:
+    if name == AUTO_BACKEND:
+        name = AUTO_FULL_BACKEND
+    try:
+        return BACKENDS[name]
+    except KeyError:
+        raise ValueError(
+            f"Backend {name} not supported, choose one of {[AUTO_BACKEND, *BACKENDS]}"
+        )
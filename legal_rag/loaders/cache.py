@@ -0,0 +1,102 @@
+"""Persistent cache of parsed PDF documents, keyed by their content."""
+
+import hashlib
+import json
+import os
+import zlib
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Sequence
+
+from legal_rag.cache import DiskCache, cache_dir
+from legal_rag.contracts.parsing import ContractIndex
+
+from .backends import DRAFT_BACKENDS, get_backend
+
+# bump when the stored format or the index parsing changes
+CACHE_FORMAT_VERSION = 2
+
+
+@dataclass
+class ParsedPDF:
+    n_pages: int
+    page_texts: Dict[int, str]
+    contract_index: ContractIndex
+    # layouts of the pages extracted by a backend that keeps them
+    page_layouts: Dict[int, Dict] = field(default_factory=dict)
+
+
+def backend_version(backend: str) -> str:
+    version = get_backend(backend).version()
+    if backend in DRAFT_BACKENDS:
+        version += "+" + get_backend(DRAFT_BACKENDS[backend]).version()
+    return version
+
+
+def document_key(bytes_data: bytes, backend: str) -> str:
+    """SHA-256 of the document, plus the extraction settings that shape its text."""
+    content = hashlib.sha256(bytes_data).hexdigest()
+    settings = f"{CACHE_FORMAT_VERSION}:{backend_version(backend)}"
+    return f"{content}:{hashlib.sha256(settings.encode()).hexdigest()[:16]}"
+
+
+class ParsedPDFCache:
+    """
+    Stores the extracted page texts (and layouts) and the `ContractIndex` of
+    a document.
+
+    Lazily parsed documents only have some of their pages extracted, so an entry
+    holds whatever pages were extracted when it was last written; `put` can be
+    called again later to add new ones.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_bytes: int = 1 << 30):
+        path = path or os.path.join(cache_dir(), "parsed_pdfs.sqlite")
+        self.store = DiskCache(path, max_bytes=max_bytes)
+
+    def get(self, key: str) -> Optional[ParsedPDF]:
+        value = self.store.get(key)
+        if value is None:
+            return None
+
+        entry = json.loads(zlib.decompress(value))
+        return ParsedPDF(
+            n_pages=entry["n_pages"],
+            page_texts={int(i): text for i, text in entry["page_texts"].items()},
+            contract_index=ContractIndex.model_validate(entry["contract_index"]),
+            page_layouts={
+                int(i): layout for i, layout in entry["page_layouts"].items()
+            },
+        )
+
+    def put(self, key: str, pages: Sequence, contract_index: ContractIndex):
+        if hasattr(pages, "page_texts"):
+            page_texts, page_layouts = pages.page_texts(), pages.page_layouts()
+        else:
+            page_texts = {i: page.page_content for i, page in enumerate(pages)}
+            page_layouts = {
+                i: page.metadata["layout"]
+                for i, page in enumerate(pages)
+                if "layout" in page.metadata
+            }
+
+        entry = {
+            "n_pages": len(pages),
+            "page_texts": page_texts,
+            "contract_index": contract_index.model_dump(),
+            "page_layouts": page_layouts,
+        }
+        self.store.set(key, zlib.compress(json.dumps(entry).encode()))
+
+    def stats(self) -> dict:
+        return self.store.stats()
+
+
+_default_cache = None
+
+
+def get_parsed_pdf_cache() -> ParsedPDFCache:
+    """Process-wide cache, created on first use."""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ParsedPDFCache()
+    return _default_cache
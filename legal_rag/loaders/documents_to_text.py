@@ -1,13 +1,15 @@
-import re
-import string
+import logging
+from typing import IO, Iterable, Iterator, Optional, Union
 
+import numpy as np
 import textdistance
+from legal_rag.contracts.chunks import ChunkIndex
+from legal_rag.loaders.normalizer import TextNormalizer
 from unstructured.documents.elements import NarrativeText
 from unstructured.partition.pdf import partition_pdf
 from unstructured.partition.text_type import sentence_count
 
 try:
-    from langchain.text_splitter import RecursiveCharacterTextSplitter
     from sentence_transformers import SentenceTransformer, util
 except ImportError:
     pass
@@ -27,12 +29,37 @@ except ImportError:
     xlsx_available = False
 
 
-def get_string_from_list(lista):
-    resultado = ""
-    for word in lista:
-        resultado += " " + word
+def iter_spaced(texts: Iterable[str]) -> Iterator[str]:
+    """Every text preceded by a space, the format of the extracted texts."""
+    for text in texts:
+        yield " "
+        yield text
+
+
+def join_texts(texts: Iterable[str]) -> str:
+    """``" t1 t2 ..."``, in a single join instead of concatenating each text."""
+    return "".join(iter_spaced(texts))
+
+
+def write_texts(texts: Iterable[str], sink: IO[str]) -> int:
+    """Write the texts as `join_texts` would return them, returns the characters written."""
+    n_chars = 0
+    for piece in iter_spaced(texts):
+        n_chars += sink.write(piece)
+    return n_chars
+
 
-    return resultado
+def join_or_write(
+    texts: Iterable[str], sink: Optional[IO[str]] = None
+) -> Union[str, int]:
+    """The joined texts, or the number of characters written to ``sink`` if given."""
+    if sink is None:
+        return join_texts(texts)
+    return write_texts(texts, sink)
+
+
+def get_string_from_list(lista):
+    return join_texts(lista)
 
 
 class TextExtractor:
@@ -41,37 +68,41 @@ class TextExtractor:
         self.lan = lan
         self.tokenizer = tokenizer
         self.stopwords = stopwords
+        self.normalizer = TextNormalizer(tokenizer, stopwords)
 
-    def get_text_from_pdf(self, pdf_file_route):
-        usando_pdf_partition = partition_pdf(pdf_file_route)
-        text_in_pdf_partition = ""
-        for el in usando_pdf_partition:
-            text_in_pdf_partition = text_in_pdf_partition + " " + str(el)
+    # Los iter_* entregan el texto de cada elemento a medida que se recorre el
+    # output del partitioner, los get_* lo unen (o lo escriben en ``sink``)
+    def iter_text_from_pdf(self, pdf_file_route) -> Iterator[str]:
+        for el in partition_pdf(pdf_file_route):
+            yield str(el)
 
-        return text_in_pdf_partition
+    def get_text_from_pdf(self, pdf_file_route, sink: Optional[IO[str]] = None):
+        return join_or_write(self.iter_text_from_pdf(pdf_file_route), sink)
 
-    def get_text_from_docx(self, docx_file_route):
+    def iter_text_from_docx(self, docx_file_route) -> Iterator[str]:
         if not docx_available:
             raise ImportError("docx is not available")
 
-        usando_docx_partition = partition_docx(filename=docx_file_route)
-        text_in_docx_partition = ""
-        for el in usando_docx_partition:
-            text_in_docx_partition = text_in_docx_partition + " " + str(el)
+        for el in partition_docx(filename=docx_file_route):
+            yield str(el)
 
-        return text_in_docx_partition
+    def get_text_from_docx(self, docx_file_route, sink: Optional[IO[str]] = None):
+        if not docx_available:
+            raise ImportError("docx is not available")
+        return join_or_write(self.iter_text_from_docx(docx_file_route), sink)
 
-    def get_text_from_xlsx(self, xlsx_file_route):
+    def iter_text_from_xlsx(self, xlsx_file_route) -> Iterator[str]:
         if not xlsx_available:
             raise ImportError("xlsx is not available")
 
         # Hay que ver como hacer esto o como aprovechar la estructura xDD
-        elements = partition_xlsx(filename=xlsx_file_route)
-        result = ""
-        for i, content in enumerate(elements):
-            result += " " + elements[i].metadata.text_as_html
+        for element in partition_xlsx(filename=xlsx_file_route):
+            yield element.metadata.text_as_html
 
-        return result
+    def get_text_from_xlsx(self, xlsx_file_route, sink: Optional[IO[str]] = None):
+        if not xlsx_available:
+            raise ImportError("xlsx is not available")
+        return join_or_write(self.iter_text_from_xlsx(xlsx_file_route), sink)
 
     def clean_text(self, text):
         """Pre-process text and generate tokens
@@ -82,59 +113,43 @@ class TextExtractor:
         Returns:
             Tokenized text.
         """
-        text = str(text).lower()  # Lowercase words
-        text = re.sub(r"\[(.*?)\]", "", text)  # Remove [+XYZ chars] in content
-        text = re.sub(r"\s+", " ", text)  # Remove multiple spaces in content
-        text = re.sub(r"\w+…|…", "", text)  # Remove ellipsis (and last word)
-        text = re.sub(r"(?<=\w)-(?=\w)", " ", text)  # Replace dash between words
-        text = re.sub(
-            f"[{re.escape(string.punctuation)}]", "", text
-        )  # Remove punctuation
-
-        tokens = self.tokenizer(text)  # Get tokens from text
-        tokens = [t for t in tokens if not t in self.stopwords]  # Remove stopwords
-        tokens = ["" if t.isdigit() else t for t in tokens]  # Remove digits
-        tokens = [t for t in tokens if len(t) > 1]  # Remove short tokens
-        return tokens
+        return self.normalizer(text)
+
+    def clean_texts(self, texts, n_workers=None):
+        """Tokens of each text, see `TextNormalizer.clean_texts`."""
+        return self.normalizer.clean_texts(texts, n_workers=n_workers)
 
     # Esta funcion podria ser util para caracterizar los documentos, recibe como input el output de un partioner
-    def get_only_narrative_text(self, elements_format):
-        text = ""
-        for element in elements_format[: len(elements_format)]:
+    def iter_narrative_text(self, elements_format) -> Iterator[str]:
+        for element in elements_format:
             if isinstance(element, NarrativeText) and sentence_count(element.text) > 2:
-                text = text + " " + element
-        return text
+                yield str(element)
+
+    def get_only_narrative_text(self, elements_format, sink: Optional[IO[str]] = None):
+        return join_or_write(self.iter_narrative_text(elements_format), sink)
 
     # Observacion: En esta funcion el unico criterio para definir oraciones es la cantidad de tokens que la componen
     # por lo que podría perderse contexto. Otro approach podria ser el metodo get_chunks bajo este metodo
     def get_sentences(self, text, sentence_size):
-        result = []
-        texto = text.split(" ")
-        i = 0
-        n_tokens = len(texto)
-        while i < n_tokens:
-            if i + sentence_size < n_tokens:
-                sentence = get_string_from_list(texto[i : i + sentence_size])
-                result.append(sentence)
-                i += sentence_size
-
-            else:
-                sentence = get_string_from_list(texto[i:n_tokens])
-                result.append(sentence)
-                break
-
-        return result
-
-    def get_chunks(self, text, chunk_size=1000):
-        text_splitter = RecursiveCharacterTextSplitter(
-            separators=[" ", ",", "\n"],
-            chunk_size=chunk_size,
-            chunk_overlap=chunk_size / 5,
-            length_function=len,
+        # las ventanas de ``sentence_size`` palabras se cortan del texto por sus
+        # offsets, sin separar todo el texto en palabras
+        spaces = np.flatnonzero(
+            np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32) == 32
         )
-        chunks = text_splitter.split_text(text)
+        word_starts = np.concatenate(([0], spaces + 1))
+        word_ends = np.concatenate((spaces, [len(text)]))
+        n_tokens = len(word_starts)
+        return [
+            " " + text[word_starts[i] : word_ends[min(i + sentence_size, n_tokens) - 1]]
+            for i in range(0, n_tokens, sentence_size)
+        ]
+
+    def get_chunk_index(self, text, chunk_size=1000) -> ChunkIndex:
+        """Chunks of ``text`` as offsets, overlapping by a fifth of ``chunk_size``."""
+        return ChunkIndex.build(text, max_chars=chunk_size, overlap=chunk_size // 5)
 
-        return chunks
+    def get_chunks(self, text, chunk_size=1000):
+        return list(self.get_chunk_index(text, chunk_size))
 
     # Función index_parser: devuelve un diccionario que tiene como llaves secciones del indice de un contrato, y su valor la pagina asociada a dicho valor
     # Recibe como input: el output de partition_pdf de "unstructured"
@@ -246,7 +261,7 @@ def select_index_section(doc_index, q_set_name, criteria):
             similarities.append((actual_section_name, similarity))
 
     # argmax of the similarities
-    print(similarities)
+    logging.debug(f"Similarities: {similarities}")
     if criteria == "semantica":
         most_likely_section = max(similarities, key=lambda x: x[1])[0]
     else:
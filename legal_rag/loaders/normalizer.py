@@ -0,0 +1,90 @@
+"""Normalize texts into the tokens used to compare and search documents."""
+
+import math
+import re
+import string
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import Callable, Iterable, List, Optional
+
+# compiled once, applied in the same order as the original clean_text. Single
+# spaces are left alone and ``\w*…`` matches what ``\w+…|…`` did
+BRACKETS = re.compile(r"\[(.*?)\]")  # [+XYZ chars] in content
+WHITESPACE = re.compile(r"\s{2,}|[^\S ]")
+ELLIPSIS = re.compile(r"\w*…")  # ellipsis (and last word)
+WORD_DASH = re.compile(r"(?<=\w)-(?=\w)")
+PUNCTUATION = re.compile(f"[{re.escape(string.punctuation)}]+")
+
+
+class TextNormalizer:
+    """
+    Lowercase ``text``, remove bracketed content, ellipses and punctuation,
+    split words joined by a dash, tokenize it and drop stopwords, digits and
+    one-character tokens.
+
+    The stopwords are frozen when the normalizer is built. Normalizers can be
+    pickled (as long as ``tokenizer`` can), so `clean_texts` can share one
+    with a process pool.
+    """
+
+    def __init__(
+        self,
+        tokenizer: Optional[Callable[[str], List[str]]] = None,
+        stopwords: Optional[Iterable[str]] = None,
+    ):
+        self.tokenizer = tokenizer or str.split
+        self.stopwords = frozenset(stopwords or ())
+
+    def __call__(self, text) -> List[str]:
+        text = str(text).lower()
+        # the rarer patterns are only searched when their character is there
+        if "[" in text:
+            text = BRACKETS.sub("", text)
+        text = WHITESPACE.sub(" ", text)
+        if "…" in text:
+            text = ELLIPSIS.sub("", text)
+        if "-" in text:
+            text = WORD_DASH.sub(" ", text)
+        text = PUNCTUATION.sub("", text)
+
+        stopwords = self.stopwords
+        return [
+            t
+            for t in self.tokenizer(text)
+            if len(t) > 1 and not t.isdigit() and t not in stopwords
+        ]
+
+    def clean_batch(self, texts: List[str]) -> List[List[str]]:
+        return [self(text) for text in texts]
+
+    def clean_texts(
+        self,
+        texts: Iterable[str],
+        n_workers: Optional[int] = None,
+        chunk_size: Optional[int] = None,
+    ) -> List[List[str]]:
+        """
+        Tokens of every text, in order.
+
+        By default texts are normalized serially. With ``n_workers > 1`` they
+        are split in batches of ``chunk_size`` texts normalized in a process
+        pool.
+        """
+        texts = list(texts)
+        if n_workers is None or n_workers <= 1 or len(texts) <= 1:
+            return self.clean_batch(texts)
+
+        if chunk_size is None:
+            # a few batches per worker so long texts do not stall the pool
+            chunk_size = max(1, math.ceil(len(texts) / (n_workers * 4)))
+        batches = [
+            texts[start : start + chunk_size]
+            for start in range(0, len(texts), chunk_size)
+        ]
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            results = executor.map(_clean_batch, repeat(self), batches)
+            return [tokens for batch in results for tokens in batch]
+
+
+def _clean_batch(normalizer: TextNormalizer, texts: List[str]) -> List[List[str]]:
+    return normalizer.clean_batch(texts)
@@ -3,22 +3,42 @@
 import abc
 import io
 import logging
+import math
 import os
 import tempfile
+import threading
 import time
-from typing import Dict, List, Optional, Union
+from collections.abc import Sequence
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple, Union
 from urllib.parse import urlparse
 
 import requests
 import streamlit as st
-from demo.contracts.parsing import ContractIndex, index_parser
+from legal_rag import tracing
+from legal_rag.contracts.parsing import ContractIndex, parse_contract_index
 from langchain_core.documents import Document
 from streamlit.runtime.uploaded_file_manager import UploadedFile
 
+from .backends import (
+    DRAFT_BACKENDS,
+    PDFMinerBackend,
+    get_backend,
+)
+from .cache import document_key, get_parsed_pdf_cache
+
 
 class BasePDFLoader(abc.ABC):
-    def __init__(self, file_or_path: Union[str, UploadedFile], name: str = None):
+    def __init__(
+        self,
+        file_or_path: Union[str, UploadedFile],
+        name: str = None,
+        backend: str = PDFMinerBackend.name,
+    ):
+        # fail early on unknown backends
+        get_backend(backend)
         self.file_or_path = file_or_path
+        self.backend = backend
         self.web_path = None
 
         if isinstance(self.file_or_path, str):
@@ -27,14 +47,15 @@ class BasePDFLoader(abc.ABC):
             )
             # read file as bytes
             with open(file_path, "rb") as f:
-                bytes_data = io.BytesIO(f.read())
+                bytes_data = f.read()
 
         else:
             bytes_data = self.file_or_path.getvalue()
 
-        self.name = (
-            name if name is not None else self.web_path or self.file_or_path.name
-        )
+        if name is None:
+            name = self.web_path or getattr(self.file_or_path, "name", None)
+            name = name or os.path.basename(self.file_or_path)
+        self.name = name
         self.bytes_data = bytes_data
 
     def get_as_file_path(self, file_path, headers=None):
@@ -100,54 +121,265 @@ class OnlinePDFLoader(BasePDFLoader):
         )
 
 
-class PDFMinerReader(BasePDFLoader):
-    """PDF parser based on pdfminer.six."""
+def _extract_page_range(
+    bytes_data: bytes,
+    page_numbers: Optional[List[int]] = None,
+    backend: str = PDFMinerBackend.name,
+) -> List[Tuple[str, Optional[Dict]]]:
+    """
+    Extract the text (and the layout, for the backends that keep it) of the
+    given (0-based) pages of a PDF held in memory. All pages are extracted
+    when ``page_numbers`` is None.
+    """
+    document = get_backend(backend)(bytes_data)
+    if page_numbers is None:
+        page_numbers = range(len(document))
+    try:
+        return [(document.extract(i), document.page_layout(i)) for i in page_numbers]
+    finally:
+        document.close()
 
-    def load_data(self, extra_info: Optional[Dict] = None) -> List[Document]:
-        """Parse file."""
-        try:
-            import io
-
-            from pdfminer.converter import TextConverter
-            from pdfminer.layout import LAParams
-            from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
-            from pdfminer.pdfpage import PDFPage
-
-            def _extract_text_from_page(page):
-                resource_manager = PDFResourceManager()
-                output_string = io.StringIO()
-                codec = "utf-8"
-                laparams = LAParams()
-                device = TextConverter(
-                    resource_manager, output_string, codec=codec, laparams=laparams
+
+# document of the worker processes of `PDFMinerReader.load_data`, opened once
+# per worker so the bytes of the PDF are not sent along with every chunk
+_worker_document = None
+
+
+def _init_extraction_worker(bytes_data: bytes, backend: str):
+    global _worker_document
+    _worker_document = get_backend(backend)(bytes_data)
+
+
+def _extract_worker_pages(page_numbers: List[int]) -> List[Tuple[str, Optional[Dict]]]:
+    """`_extract_page_range` of the document opened by `_init_extraction_worker`."""
+    return [
+        (_worker_document.extract(i), _worker_document.page_layout(i))
+        for i in page_numbers
+    ]
+
+
+def count_pages(bytes_data: bytes) -> int:
+    """Count the pages of a PDF without running any layout analysis."""
+    from pdfminer.pdfpage import PDFPage
+
+    return sum(1 for _ in PDFPage.get_pages(io.BytesIO(bytes_data)))
+
+
+class LazyPDFPages(Sequence):
+    """
+    List-like view over the pages of a PDF that extracts a page the first time
+    it is accessed and memoizes it.
+
+    Only the page tree is parsed up front, the (expensive) layout analysis runs
+    on demand, so a pipeline that reads the index pages and a single section
+    never pays for the rest of the document. ``n_extracted`` reports how many
+    pages have actually been extracted.
+
+    With ``backend="auto"`` (or "pdfminer-outline") pages are extracted with
+    the full layout backend, while `draft` gives a cheap extraction of a page
+    (see `loaders.backends.DRAFT_BACKENDS`), good enough to look for the index
+    or the headings but not to be sent to the LLM.
+    """
+
+    def __init__(
+        self,
+        bytes_data: bytes,
+        name: str,
+        extra_info: Optional[Dict] = None,
+        backend: str = PDFMinerBackend.name,
+        n_pages: Optional[int] = None,
+        page_texts: Optional[Dict[int, str]] = None,
+        page_layouts: Optional[Dict[int, Dict]] = None,
+    ):
+        self.name = name
+        self.extra_info = extra_info
+        self.backend = backend
+        self.bytes_data = bytes_data
+        # set by parse_pdf when the pages are backed by the ParsedPDFCache
+        self.cache_key = None
+        self.n_cached = 0
+        self._document = None
+        self._draft_document = None
+        if n_pages is None:
+            n_pages = len(self._open_document())
+        self._docs: List[Optional[Document]] = [None] * n_pages
+        self._drafts: List[Optional[Document]] = [None] * n_pages
+        page_layouts = page_layouts or {}
+        for i, page_text in (page_texts or {}).items():
+            self._docs[i] = self._new_document(i, page_text, page_layouts.get(i))
+        self._lock = threading.Lock()
+
+    def _open_document(self):
+        # pages that came from the cache do not need the PDF to be parsed at all
+        if self._document is None:
+            self._document = get_backend(self.backend)(self.bytes_data)
+        return self._document
+
+    def _open_draft_document(self):
+        if self._draft_document is None and self.backend in DRAFT_BACKENDS:
+            draft_backend = DRAFT_BACKENDS[self.backend]
+            self._draft_document = get_backend(draft_backend)(self.bytes_data)
+        return self._draft_document
+
+    @property
+    def n_extracted(self) -> int:
+        return sum(doc is not None for doc in self._docs)
+
+    def _new_document(self, i: int, page_text: str, layout: Dict = None) -> Document:
+        metadata = {"page": i, "file_name": self.name}
+        if layout is not None:
+            metadata["layout"] = layout
+        if self.extra_info is not None:
+            metadata.update(self.extra_info)
+        return Document(page_content=page_text, metadata=metadata)
+
+    def _get_page(self, i: int) -> Document:
+        doc = self._docs[i]
+        if doc is not None:
+            return doc
+
+        with self._lock, tracing.span("extract_page", page=i) as span:
+            if self._docs[i] is None:
+                document = self._open_document()
+                page_text = document.extract(i)
+                self._docs[i] = self._new_document(
+                    i, page_text, document.page_layout(i)
                 )
-                interpreter = PDFPageInterpreter(resource_manager, device)
-                interpreter.process_page(page)
-                text = output_string.getvalue()
-                device.close()
-                output_string.close()
-                return text
-
-        except ImportError:
-            raise ImportError(
-                "pdfminer.six is required to read PDF files: `pip install pypdf`"
-            )
+                span.set(pages_extracted=1, backend=self.backend)
+            return self._docs[i]
+
+    def draft(self, i: int) -> Document:
+        """
+        Cheap extraction of page ``i``, falls back to the full extraction when
+        there is no draft backend or the page was already extracted.
+        """
+        if self.backend not in DRAFT_BACKENDS or self._docs[i] is not None:
+            return self._get_page(i)
+
+        with self._lock, tracing.span("extract_draft_page", page=i):
+            if self._drafts[i] is None:
+                page_text = self._open_draft_document().extract(i)
+                self._drafts[i] = self._new_document(i, page_text)
+            return self._drafts[i]
+
+    def page_texts(self) -> Dict[int, str]:
+        """Texts of the pages extracted so far, by page number."""
+        return {
+            i: doc.page_content for i, doc in enumerate(self._docs) if doc is not None
+        }
+
+    def page_layouts(self) -> Dict[int, Dict]:
+        """Layouts of the pages extracted so far, for the backends that keep them."""
+        return {
+            i: doc.metadata["layout"]
+            for i, doc in enumerate(self._docs)
+            if doc is not None and "layout" in doc.metadata
+        }
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._get_page(i) for i in range(len(self))[index]]
+        return self._get_page(range(len(self))[index])
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._get_page(i)
+
+    def __repr__(self) -> str:
+        return (
+            f"{type(self).__name__}(name={self.name!r}, pages={len(self)}, "
+            f"extracted={self.n_extracted}, backend={self.backend!r})"
+        )
+
+
+class PDFMinerReader(BasePDFLoader):
+    """PDF parser based on pdfminer.six, other backends can be chosen with ``backend``."""
+
+    def load_data(
+        self,
+        extra_info: Optional[Dict] = None,
+        n_workers: Optional[int] = None,
+        chunk_size: Optional[int] = None,
+    ) -> List[Document]:
+        """
+        Parse file.
+
+        By default pages are extracted serially. With ``n_workers > 1`` the page
+        range is split in contiguous chunks of ``chunk_size`` pages which are
+        extracted in a process pool; the returned pages keep the document order.
+        Each worker receives the PDF and opens it once, the chunks only carry
+        their page numbers.
+        """
+        backend = get_backend(self.backend).name
+        if n_workers is None or n_workers <= 1:
+            extracted = _extract_page_range(self.bytes_data, backend=backend)
+        else:
+            n_pages = count_pages(self.bytes_data)
+            if chunk_size is None:
+                # a few chunks per worker so slow pages do not stall the pool
+                chunk_size = max(1, math.ceil(n_pages / (n_workers * 4)))
+
+            chunks = [
+                list(range(start, min(start + chunk_size, n_pages)))
+                for start in range(0, n_pages, chunk_size)
+            ]
+            with ProcessPoolExecutor(
+                max_workers=n_workers,
+                initializer=_init_extraction_worker,
+                initargs=(self.bytes_data, backend),
+            ) as executor:
+                results = executor.map(_extract_worker_pages, chunks)
+                extracted = [page for chunk in results for page in chunk]
 
-        # if isinstance(self.bytes_data, io.BytesIO):
-        reader = PDFPage.get_pages(io.BytesIO(self.bytes_data))
         docs = []
-        for i, page in enumerate(reader):
-            page_text = _extract_text_from_page(page)
+        for i, (page_text, layout) in enumerate(extracted):
             metadata = {"page": i, "file_name": self.name}
+            if layout is not None:
+                metadata["layout"] = layout
             if extra_info is not None:
                 metadata.update(extra_info)
 
             docs.append(Document(page_content=page_text, metadata=metadata))
         return docs
 
+    def load_lazy(self, extra_info: Optional[Dict] = None) -> LazyPDFPages:
+        """Return the pages without extracting them, see `LazyPDFPages`."""
+        return LazyPDFPages(
+            self.bytes_data, self.name, extra_info=extra_info, backend=self.backend
+        )
+
+
+def extracted_page_count(pages: Sequence) -> int:
+    """Number of pages whose text has actually been extracted."""
+    return getattr(pages, "n_extracted", len(pages))
+
+
+def update_parsed_pdf_cache(pages: Sequence, contract_index: ContractIndex):
+    """
+    Store the pages that were extracted after `parse_pdf` returned, typically
+    the pages of the section used as context, so a cache hit also has them.
+    """
+    cache_key = getattr(pages, "cache_key", None)
+    if cache_key is None or pages.n_extracted == pages.n_cached:
+        return
+
+    get_parsed_pdf_cache().put(cache_key, pages, contract_index)
+    pages.n_cached = pages.n_extracted
+
 
 # @st.cache_data
-def parse_pdf(file: UploadedFile, results=None) -> List[Union[Document, ContractIndex]]:
+def parse_pdf(
+    file: UploadedFile,
+    results=None,
+    n_workers: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+    lazy: bool = True,
+    backend: str = PDFMinerBackend.name,
+    use_cache: bool = True,
+) -> List[Union[Document, ContractIndex]]:
     """
     Parse a document and return the pages and the index.
 
@@ -157,22 +389,77 @@ def parse_pdf(file: UploadedFile, results=None) -> List[Union[Document, Contract
 
     This is basically a wrapper around the PDFMinerParser,
     just as langchain's PDFMinerLoader.
+
+    By default the pages are returned as a `LazyPDFPages`, so only
+    the index pages and the pages that are later used as context
+    get extracted. With ``lazy=False`` every page is extracted up
+    front; set ``n_workers`` to do it in a process pool of that
+    size, ``chunk_size`` pages at a time.
+
+    ``backend`` selects the text extraction backend (see
+    `loaders.backends.BACKENDS`); "auto" looks for the index with
+    a cheap backend and uses the full layout analysis for the
+    pages that end up in the context.
+
+    With ``use_cache`` the extracted pages and the index are kept in
+    the `ParsedPDFCache`, keyed by the SHA-256 of the file, so parsing
+    the same contract again only reads them back from disk.
     """
     logging.info(f"Received file: {file.name} of type {file.type}")
 
     s_time = time.time()
-    # load pdf
-    reader = PDFMinerReader(file)
-    pages = reader.load_data()
-    print(pages[0])
-    contract_index = index_parser(pages)
+    with tracing.span("parse_pdf", backend=backend, lazy=lazy) as span:
+        # load pdf
+        with tracing.span("read_upload") as read_span:
+            reader = PDFMinerReader(file, backend=backend)
+            read_span.set(bytes=len(reader.bytes_data))
+        cache, cache_key, cached = None, None, None
+        if use_cache:
+            cache = get_parsed_pdf_cache()
+            cache_key = document_key(reader.bytes_data, backend)
+            cached = cache.get(cache_key)
+
+        if cached is not None and (lazy or len(cached.page_texts) == cached.n_pages):
+            logging.info(f"Cache hit for {file.name}: {cache_key}")
+            span.set(cache_hits=1)
+            pages = LazyPDFPages(
+                reader.bytes_data,
+                reader.name,
+                backend=backend,
+                n_pages=cached.n_pages,
+                page_texts=cached.page_texts,
+                page_layouts=cached.page_layouts,
+            )
+            pages = pages if lazy else list(pages)
+            contract_index = cached.contract_index
+        else:
+            span.set(cache_misses=1 if use_cache else 0)
+            if lazy:
+                pages = reader.load_lazy()
+            else:
+                with tracing.span("extract_pages", n_workers=n_workers) as extract_span:
+                    pages = reader.load_data(n_workers=n_workers, chunk_size=chunk_size)
+                    extract_span.set(pages_extracted=len(pages))
+            logging.debug(f"First page: {pages[0]}")
+            with tracing.span("toc_detection") as toc_span:
+                contract_index = parse_contract_index(pages)
+                toc_span.set(sections=len(contract_index.sections))
+            if cache is not None:
+                cache.put(cache_key, pages, contract_index)
+        span.set(pages=len(pages))
+
+    if lazy:
+        pages.cache_key = cache_key
+        pages.n_cached = extracted_page_count(pages)
     n_paginas = len(pages)
 
-    logging.info(f"Loaded {n_paginas} pages in {time.time() - s_time} seconds")
+    logging.info(
+        f"Loaded {n_paginas} pages ({extracted_page_count(pages)} extracted) in {time.time() - s_time} seconds"
+    )
     logging.info(
         f"ContractIndex has: {len(contract_index.sections)} sections, {len(contract_index.annex_names)} annex names, {contract_index.contains_kpi_annex} -> wrt. a KPI Annex"
     )
-    
+
     logging.info(f"Found sections: {contract_index.sections}")
     logging.info(f"Found annex names: {contract_index.annex_names}")
     logging.info(f"Contains KPI Annex: {contract_index.contains_kpi_annex}")
@@ -0,0 +1,82 @@
+"""Persistent cache of validated LLM responses."""
+
+import hashlib
+import json
+import logging
+import os
+from typing import List, Optional, Type
+
+from legal_rag.cache import DiskCache, cache_dir
+from pydantic import BaseModel, ValidationError
+
+# 30 days, answers of old runs are not trusted forever
+DEFAULT_TTL = 30 * 24 * 3600
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def response_key(
+    model_name: str,
+    temperature: float,
+    max_tokens: int,
+    response_model: Type[BaseModel],
+    messages: List[dict],
+) -> str:
+    """
+    Key of a completion: every parameter that changes the response, including
+    the JSON schema of the response model and the fully formatted prompt.
+    """
+    schema = json.dumps(response_model.model_json_schema(), sort_keys=True)
+    key = {
+        "model": model_name,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "response_model": _sha256(schema),
+        "prompt": _sha256(json.dumps(messages, sort_keys=True, ensure_ascii=False)),
+    }
+    return _sha256(json.dumps(key, sort_keys=True))
+
+
+class ResponseCache:
+    """Validated responses (as JSON) stored in a `DiskCache` with TTL and size eviction."""
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        max_bytes: int = 256 << 20,
+        ttl: Optional[float] = DEFAULT_TTL,
+    ):
+        path = path or os.path.join(cache_dir(), "llm_responses.sqlite")
+        self.store = DiskCache(path, max_bytes=max_bytes, ttl=ttl)
+
+    def get(self, key: str, response_model: Type[BaseModel]) -> Optional[BaseModel]:
+        value = self.store.get(key)
+        if value is None:
+            return None
+        try:
+            return response_model.model_validate_json(value)
+        except ValidationError:
+            logging.warning(f"Dropping invalid cached response {key}")
+            self.store.delete(key)
+            return None
+
+    def put(self, key: str, response: BaseModel):
+        # our models default some fields to None without making them Optional,
+        # leaving defaults out keeps the JSON valid for the model
+        self.store.set(key, response.model_dump_json(exclude_defaults=True).encode())
+
+    def stats(self) -> dict:
+        return self.store.stats()
+
+
+_default_cache = None
+
+
+def get_response_cache() -> ResponseCache:
+    """Process-wide cache, created on first use."""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ResponseCache()
+    return _default_cache
@@ -0,0 +1,278 @@
+"""Shared OpenAI clients, rate limiting and retries."""
+
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+import weakref
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator, Callable, Dict, Optional, Tuple, TypeVar
+
+import httpx
+import instructor
+import openai
+
+T = TypeVar("T")
+
+# requests and tokens per minute of each model, the defaults of our account,
+# overridden with LEGAL_RAG_RATE_LIMITS, e.g. "gpt-4=500:40000,gpt-4-32k=500:80000"
+MODEL_RATE_LIMITS: Dict[str, Tuple[int, int]] = {
+    "gpt-4": (500, 10_000),
+    "gpt-4-32k": (500, 20_000),
+    "gpt-4-1106-preview": (500, 150_000),
+    "gpt-3.5-turbo": (3_500, 60_000),
+    "gpt-3.5-turbo-16k": (3_500, 60_000),
+    "gpt-3.5-turbo-1106": (3_500, 60_000),
+}
+DEFAULT_RATE_LIMIT = (500, 10_000)
+
+
+def rate_limits_from_env() -> Dict[str, Tuple[int, int]]:
+    """Rate limits of ``LEGAL_RAG_RATE_LIMITS``, as ``model=rpm:tpm`` pairs."""
+    limits = {}
+    for entry in os.getenv("LEGAL_RAG_RATE_LIMITS", "").split(","):
+        if not entry.strip():
+            continue
+        try:
+            model_name, limit = entry.split("=")
+            rpm, tpm = limit.split(":")
+            limits[model_name.strip()] = (int(rpm), int(tpm))
+        except ValueError:
+            raise ValueError(
+                f"Invalid rate limit {entry!r} in LEGAL_RAG_RATE_LIMITS,"
+                " use model=rpm:tpm"
+            ) from None
+    return limits
+
+
+HTTP_LIMITS = httpx.Limits(max_connections=32, max_keepalive_connections=16)
+HTTP_TIMEOUT = httpx.Timeout(120.0, connect=10.0)
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at ``per_minute`` units per minute, up to
+    one minute worth of capacity. ``reserve`` takes units right away (the level
+    may go negative) and returns how long the caller has to wait to respect the
+    rate, so waiting callers are served in order.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = per_minute
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        with self._lock:
+            self._refill(time.monotonic())
+            self.level -= amount
+            return max(0.0, -self.level / self.rate)
+
+    def refund(self, amount: float):
+        """Give back units that were reserved but not used (or take more if negative)."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.level = min(self.capacity, self.level + amount)
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute limits of a model."""
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+
+    def _reserve(self, tokens: int) -> Tuple[float, int]:
+        # requests larger than the bucket would never fit, they take all of it
+        tokens = min(tokens, int(self.tokens.capacity))
+        return max(self.requests.reserve(1), self.tokens.reserve(tokens)), tokens
+
+    def acquire(self, tokens: int) -> int:
+        """
+        Wait until a call of ``tokens`` fits in the limits, returns the tokens
+        reserved for it, to `settle` once its usage is known.
+        """
+        wait, reserved = self._reserve(tokens)
+        if wait > 0:
+            logging.info(f"Rate limited, waiting {wait:.2f}s")
+            time.sleep(wait)
+        return reserved
+
+    async def aacquire(self, tokens: int) -> int:
+        wait, reserved = self._reserve(tokens)
+        if wait > 0:
+            logging.info(f"Rate limited, waiting {wait:.2f}s")
+            await asyncio.sleep(wait)
+        return reserved
+
+    def settle(self, reserved: int, used: int):
+        """
+        Correct the token bucket once the actual usage of a call is known,
+        ``reserved`` is what `acquire` returned for it.
+        """
+        self.tokens.refund(reserved - used)
+
+
+@dataclass
+class RetryPolicy:
+    max_retries: int = 6
+    base_delay: float = 1.0
+    max_delay: float = 60.0
+
+    def delay(self, attempt: int, error: Exception) -> float:
+        """Full jitter exponential backoff, honoring Retry-After when the API sends it."""
+        response = getattr(error, "response", None)
+        retry_after = (
+            response.headers.get("retry-after") if response is not None else None
+        )
+        if retry_after is not None:
+            try:
+                return min(float(retry_after), self.max_delay)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, (openai.RateLimitError, openai.APIConnectionError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+def call_with_retries(fn: Callable[[], T], policy: RetryPolicy = None) -> Tuple[T, int]:
+    """Call ``fn`` retrying 429/5xx/connection errors, returns the result and the retries."""
+    policy = policy or RetryPolicy()
+    for attempt in range(policy.max_retries + 1):
+        try:
+            return fn(), attempt
+        except Exception as e:
+            if not is_retryable(e) or attempt == policy.max_retries:
+                raise
+            delay = policy.delay(attempt, e)
+            logging.warning(f"{type(e).__name__}, retrying in {delay:.2f}s")
+            time.sleep(delay)
+
+
+async def acall_with_retries(fn, policy: RetryPolicy = None):
+    """Async version of `call_with_retries`, ``fn`` returns an awaitable."""
+    policy = policy or RetryPolicy()
+    for attempt in range(policy.max_retries + 1):
+        try:
+            return await fn(), attempt
+        except Exception as e:
+            if not is_retryable(e) or attempt == policy.max_retries:
+                raise
+            delay = policy.delay(attempt, e)
+            logging.warning(f"{type(e).__name__}, retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+
+class ClientManager:
+    """
+    Process-wide OpenAI clients: one instructor-patched client per model, on a
+    pooled HTTP connection so TLS sessions are reused between calls, and one
+    `RateLimiter` per model. Retries are left to `call_with_retries`, so the
+    clients themselves do not retry.
+
+    The limits of ``rate_limits`` take precedence over the ones of
+    ``LEGAL_RAG_RATE_LIMITS``, which take precedence over `MODEL_RATE_LIMITS`.
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None,
+        rate_limits: Optional[Dict[str, Tuple[int, int]]] = None,
+    ):
+        self.api_key = api_key or os.getenv("OPENAI_API_KEY")
+        self.base_url = base_url or os.getenv("OPENAI_BASE_URL")
+        self.rate_limits = {
+            **MODEL_RATE_LIMITS,
+            **rate_limits_from_env(),
+            **(rate_limits or {}),
+        }
+        self._clients: Dict[str, openai.OpenAI] = {}
+        # async clients are bound to the event loop they were created in, they
+        # are closed when the last `async_session` of their loop ends
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._async_sessions = weakref.WeakKeyDictionary()
+        self._limiters: Dict[str, RateLimiter] = {}
+        self._lock = threading.Lock()
+
+    def get_client(self, model_name: str) -> openai.OpenAI:
+        with self._lock:
+            if model_name not in self._clients:
+                client = openai.OpenAI(
+                    api_key=self.api_key,
+                    base_url=self.base_url,
+                    max_retries=0,
+                    http_client=httpx.Client(limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT),
+                )
+                self._clients[model_name] = instructor.patch(client)
+            return self._clients[model_name]
+
+    def get_async_client(self, model_name: str) -> openai.AsyncOpenAI:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            clients = self._async_clients.setdefault(loop, {})
+            if model_name not in clients:
+                client = openai.AsyncOpenAI(
+                    api_key=self.api_key,
+                    base_url=self.base_url,
+                    max_retries=0,
+                    http_client=httpx.AsyncClient(
+                        limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT
+                    ),
+                )
+                clients[model_name] = instructor.patch(client)
+            return clients[model_name]
+
+    @asynccontextmanager
+    async def async_session(self) -> AsyncIterator["ClientManager"]:
+        """
+        Use the async clients of the running loop inside the block, they are
+        closed (and created again if needed) once no session of the loop is left.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._async_sessions[loop] = self._async_sessions.get(loop, 0) + 1
+        try:
+            yield self
+        finally:
+            clients = {}
+            with self._lock:
+                self._async_sessions[loop] -= 1
+                if self._async_sessions[loop] == 0:
+                    del self._async_sessions[loop]
+                    clients = self._async_clients.pop(loop, {})
+            for client in clients.values():
+                await client.close()
+
+    def limiter(self, model_name: str) -> RateLimiter:
+        with self._lock:
+            if model_name not in self._limiters:
+                rpm, tpm = self.rate_limits.get(model_name, DEFAULT_RATE_LIMIT)
+                self._limiters[model_name] = RateLimiter(rpm, tpm)
+            return self._limiters[model_name]
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_client_manager() -> ClientManager:
+    """Process-wide `ClientManager`, created on first use."""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = ClientManager()
+        return _manager
@@ -1,64 +1,372 @@
 import logging
-from functools import partial
 import os
+import time
+from contextlib import contextmanager
+from typing import Iterator, List
 
-import instructor
-import openai
-import streamlit as st
-from legal_rag.contracts.questions import AnswerSet
-from legal_rag.utils import check_streamlit
+from legal_rag import tracing
+from legal_rag.contracts.questions import Answer, AnswerSet
+from legal_rag.contracts.tokens import EstimatingTokenizer
+from legal_rag.models.cache import get_response_cache, response_key
+from legal_rag.models.clients import (
+    acall_with_retries,
+    call_with_retries,
+    get_client_manager,
+)
+from legal_rag.models.usage import current_scope, get_usage_ledger
+from instructor.function_calls import openai_schema
+from pydantic import ValidationError
 
 DEFAULT_MODEL_NAME = "gpt-4-1106-preview"
+USER_MESSAGE = "Answers: ..."
+MAX_COMPLETION_TOKENS = 1000
+TEMPERATURE = 0.1
+
+# context window of each model, in tokens
+MODEL_TOKEN_LIMITS = {
+    "gpt-4": 8192,
+    "gpt-4-32k": 32768,
+    "gpt-4-1106-preview": 128000,
+    "gpt-3.5-turbo": 4096,
+    "gpt-3.5-turbo-16k": 16385,
+    "gpt-3.5-turbo-1106": 16385,
+}
+DEFAULT_TOKEN_LIMIT = 4096
+
+
+def model_token_limit(model_name: str) -> int:
+    return MODEL_TOKEN_LIMITS.get(model_name, DEFAULT_TOKEN_LIMIT)
+
 
 def load_env_var(var_name):
     return os.getenv(var_name)
 
-def native_oai_chain(
-    extraction_prompt, ctx, model_name=DEFAULT_MODEL_NAME
-) -> AnswerSet:
-    openai.api_key = load_env_var("OPENAI_API_KEY")
 
-    logging.info("Patching OpenAI API w/ instructor")
-    client = instructor.patch(openai.OpenAI(api_key=openai.api_key))
-    completion_create_fn = partial(
-        client.chat.completions.create,
-        model=model_name,
+@tracing.traced("format_prompt")
+def build_messages(extraction_prompt, str_ctx):
+    system_message = extraction_prompt.format(context=str_ctx)
+    tracing.current_span().set(prompt_chars=len(system_message))
+    return [
+        {"role": "system", "content": system_message},
+        {"role": "user", "content": USER_MESSAGE},
+    ]
+
+
+def request_tokens(messages) -> int:
+    """Tokens reserved in the rate limiter for a request, before knowing its usage."""
+    tokenizer = EstimatingTokenizer()
+    prompt = sum(tokenizer.count(m["content"]) for m in messages)
+    return prompt + MAX_COMPLETION_TOKENS
+
+
+def used_tokens(response) -> int:
+    raw = getattr(response, "_raw_response", None)
+    usage = getattr(raw, "usage", None)
+    return usage.total_tokens if usage is not None else None
+
+
+@contextmanager
+def reserve_token_budget(tokens: int) -> Iterator[None]:
+    """
+    Hold ``tokens`` of the budget of the current usage scope during a call,
+    raise `TokenBudgetExceeded` if it was already spent or reserved.
+    """
+    budget = current_scope().budget
+    if budget is None:
+        yield
+        return
+    budget.reserve(tokens)
+    try:
+        yield
+    finally:
+        budget.release(tokens)
+
+
+def record_usage(
+    model_name, messages, response=None, latency=0.0, retries=0, cached=False
+):
+    """
+    Record a call in the `UsageLedger` and return its total tokens. Without
+    usage in the response (cache hits have none, streams do not report it)
+    the tokens are estimated.
+    """
+    if cached:
+        get_usage_ledger().record(model_name, cached=True)
+        return 0
+
+    usage = getattr(getattr(response, "_raw_response", None), "usage", None)
+    if usage is not None:
+        prompt_tokens, completion_tokens = usage.prompt_tokens, usage.completion_tokens
+    else:
+        tokenizer = EstimatingTokenizer()
+        prompt_tokens = sum(tokenizer.count(m["content"]) for m in messages)
+        completion_tokens = tokenizer.count(response.model_dump_json())
+    get_usage_ledger().record(
+        model_name,
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        latency=latency,
+        retries=retries,
+        estimated=usage is None,
     )
+    return prompt_tokens + completion_tokens
 
-    @st.cache_resource
-    def st_oai_call(str_ctx):
-        response = completion_create_fn(
-            response_model=AnswerSet,
-            messages=[
-                {
-                    "role": "system",
-                    "content": extraction_prompt.format(context=str_ctx),
-                },
-                {"role": "user", "content": "Answers: ..."},
-            ],
-            max_tokens=1000,
-            temperature=0.1,
+
+@tracing.traced("llm_call")
+async def async_oai_chain(
+    extraction_prompt, ctx, model_name=DEFAULT_MODEL_NAME, client=None, use_cache=True
+) -> AnswerSet:
+    """Async version of `native_oai_chain`, returns the `AnswerSet`."""
+    messages = build_messages(extraction_prompt, ctx.str_context)
+    cache, key = None, None
+    if use_cache:
+        cache = get_response_cache()
+        key = response_key(
+            model_name, TEMPERATURE, MAX_COMPLETION_TOKENS, AnswerSet, messages
         )
-        return response
+        response = cache.get(key, AnswerSet)
+        if response is not None:
+            logging.info(f"Cached response for {ctx.section_name}")
+            tracing.current_span().set(model=model_name, cache_hits=1)
+            record_usage(model_name, messages, cached=True)
+            return response
+
+    tracing.current_span().set(model=model_name, cache_misses=1)
+    manager = get_client_manager()
+    client = client or manager.get_async_client(model_name)
+    limiter = manager.limiter(model_name)
+    tokens = request_tokens(messages)
 
-    def oai_call(str_ctx):
-        response = completion_create_fn(
+    async def call():
+        return await client.chat.completions.create(
+            model=model_name,
             response_model=AnswerSet,
-            messages=[
-                {
-                    "role": "system",
-                    "content": extraction_prompt.format(context=str_ctx),
-                },
-                {"role": "user", "content": "Answers: ..."},
-            ],
-            max_tokens=4000,
-            temperature=0.1,
+            messages=messages,
+            max_tokens=MAX_COMPLETION_TOKENS,
+            temperature=TEMPERATURE,
         )
-        return response
 
-    response = st_oai_call(ctx.str_context) if check_streamlit() else oai_call
+    with reserve_token_budget(tokens):
+        # once for all the retries, whose backoff already slows them down
+        reserved = await limiter.aacquire(tokens)
+        s_time = time.time()
+        try:
+            response, retries = await acall_with_retries(call)
+        except Exception:
+            # the failed attempts did not use any token
+            limiter.settle(reserved, 0)
+            raise
+        record_usage(model_name, messages, response, time.time() - s_time, retries)
+    used = used_tokens(response)
+    if used is not None:
+        limiter.settle(reserved, used)
+    if cache is not None:
+        cache.put(key, response)
+    return response
+
+
+@tracing.traced("llm_call")
+def native_oai_chain(
+    extraction_prompt, ctx, model_name=DEFAULT_MODEL_NAME, use_cache=True
+) -> AnswerSet:
+    """
+    Answer the questions of ``extraction_prompt`` with ``ctx``.
+
+    Responses are stored in the `ResponseCache`, so asking the same prompt
+    with the same context again does not call the API.
+    """
+    messages = build_messages(extraction_prompt, ctx.str_context)
+    cache, key, response = None, None, None
+    if use_cache:
+        cache = get_response_cache()
+        key = response_key(
+            model_name, TEMPERATURE, MAX_COMPLETION_TOKENS, AnswerSet, messages
+        )
+        response = cache.get(key, AnswerSet)
+        if response is not None:
+            logging.info(f"Cached response for {ctx.section_name}")
+            tracing.current_span().set(model=model_name, cache_hits=1)
+            record_usage(model_name, messages, cached=True)
+
+    if response is None:
+        tracing.current_span().set(model=model_name, cache_misses=1)
+        manager = get_client_manager()
+        client = manager.get_client(model_name)
+        limiter = manager.limiter(model_name)
+        tokens = request_tokens(messages)
+
+        def call():
+            return client.chat.completions.create(
+                model=model_name,
+                response_model=AnswerSet,
+                messages=messages,
+                max_tokens=MAX_COMPLETION_TOKENS,
+                temperature=TEMPERATURE,
+            )
+
+        with reserve_token_budget(tokens):
+            # once for all the retries, whose backoff already slows them down
+            reserved = limiter.acquire(tokens)
+            s_time = time.time()
+            try:
+                response, retries = call_with_retries(call)
+            except Exception:
+                # the failed attempts did not use any token
+                limiter.settle(reserved, 0)
+                raise
+            record_usage(model_name, messages, response, time.time() - s_time, retries)
+        used = used_tokens(response)
+        if used is not None:
+            limiter.settle(reserved, used)
+        if cache is not None:
+            cache.put(key, response)
+
     # check if the response is an AnswerSet
     is_answerset = hasattr(response, "answers")
     # check if the response is a str json
     is_json = isinstance(response, str) and response.startswith("{")
     return response, "answerset" if is_answerset else "json" if is_json else "unknown"
+
+
+class ArrayItemScanner:
+    """
+    Split the items of the first JSON array found in a stream of text chunks,
+    returning the JSON of each item as soon as it is closed.
+    """
+
+    def __init__(self):
+        self.started = False
+        self.finished = False
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.item = []
+
+    def feed(self, chunk: str) -> List[str]:
+        items = []
+        for c in chunk:
+            if self.finished:
+                break
+            if self.depth > 0:
+                self.item.append(c)
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif c == "\\":
+                    self.escape = True
+                elif c == '"':
+                    self.in_string = False
+            elif c == '"':
+                self.in_string = True
+            elif not self.started:
+                self.started = c == "["
+            elif c in "{[":
+                if self.depth == 0:
+                    self.item = [c]
+                self.depth += 1
+            elif c in "}]":
+                if self.depth == 0:
+                    # end of the array
+                    self.finished = True
+                    break
+                self.depth -= 1
+                if self.depth == 0:
+                    items.append("".join(self.item))
+        return items
+
+
+def stream_answers(
+    extraction_prompt, ctx, model_name=DEFAULT_MODEL_NAME, use_cache=True
+) -> Iterator[Answer]:
+    """
+    Streaming version of `native_oai_chain`, yields each `Answer` as soon as
+    the model finishes writing it.
+
+    The complete `AnswerSet` is stored in the `ResponseCache` under the same
+    key as `native_oai_chain`, so both share the cached responses.
+    """
+    messages = build_messages(extraction_prompt, ctx.str_context)
+    cache, key, response = None, None, None
+    if use_cache:
+        cache = get_response_cache()
+        key = response_key(
+            model_name, TEMPERATURE, MAX_COMPLETION_TOKENS, AnswerSet, messages
+        )
+        with tracing.span("response_cache_get") as span:
+            response = cache.get(key, AnswerSet)
+            span.set(cache_hits=int(response is not None))
+    if response is not None:
+        logging.info(f"Cached response for {ctx.section_name}")
+        record_usage(model_name, messages, cached=True)
+        yield from response.answers
+        return
+
+    manager = get_client_manager()
+    client = manager.get_client(model_name)
+    limiter = manager.limiter(model_name)
+    tokens = request_tokens(messages)
+    schema = openai_schema(AnswerSet).openai_schema
+
+    def call():
+        return client.chat.completions.create(
+            model=model_name,
+            messages=messages,
+            functions=[schema],
+            function_call={"name": schema["name"]},
+            max_tokens=MAX_COMPLETION_TOKENS,
+            temperature=TEMPERATURE,
+            stream=True,
+        )
+
+    with reserve_token_budget(tokens):
+        # once for all the retries, whose backoff already slows them down
+        reserved = limiter.acquire(tokens)
+        # the span times the call up to the first byte, the stream is read lazily
+        s_time = time.time()
+        with tracing.span("llm_call", model=model_name, stream=True, cache_misses=1):
+            try:
+                stream, retries = call_with_retries(call)
+            except Exception:
+                # the failed attempts did not use any token
+                limiter.settle(reserved, 0)
+                raise
+        # the latency leaves out the time the caller takes with each answer
+        latency = 0.0
+        scanner = ArrayItemScanner()
+        answers = []
+        n_invalid = 0
+        try:
+            for chunk in stream:
+                if not chunk.choices or chunk.choices[0].delta.function_call is None:
+                    continue
+                arguments = chunk.choices[0].delta.function_call.arguments or ""
+                for item in scanner.feed(arguments):
+                    try:
+                        answer = Answer.model_validate_json(item)
+                    except ValidationError as e:
+                        logging.warning(f"Invalid answer skipped: {e}")
+                        n_invalid += 1
+                        continue
+                    answers.append(answer)
+                    latency += time.time() - s_time
+                    yield answer
+                    s_time = time.time()
+            latency += time.time() - s_time
+        finally:
+            # also when the caller stops reading early, the call was paid anyway
+            used = record_usage(
+                model_name,
+                messages,
+                AnswerSet(answers=answers),
+                latency=latency,
+                retries=retries,
+            )
+            limiter.settle(reserved, used)
+    if not scanner.finished:
+        # the completion was cut, e.g. by max_tokens, do not cache it
+        logging.warning(f"Incomplete streamed response for {ctx.section_name}")
+    elif n_invalid > 0:
+        # the answers skipped would be missing from the cache too
+        logging.warning(f"Invalid answers for {ctx.section_name}, not cached")
+    elif cache is not None:
+        cache.put(key, AnswerSet(answers=answers))
@@ -0,0 +1,239 @@
+"""Ledger of the tokens and latency of every LLM call, per document and question set."""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional
+
+from legal_rag.cache import cache_dir
+
+
+class TokenBudgetExceeded(RuntimeError):
+    """Raised instead of calling the API once a batch has spent its token budget."""
+
+
+class TokenBudget:
+    """
+    Tokens a batch of calls may spend. Each call `reserve`s its estimated
+    tokens while in flight, so no new call is issued once ``spent`` plus the
+    tokens reserved by the concurrent calls reach ``max_tokens``. Calls
+    already in flight finish (and count what they actually used).
+    """
+
+    def __init__(self, max_tokens: int, name: str = "batch"):
+        self.max_tokens = max_tokens
+        self.name = name
+        self.spent = 0
+        self.reserved = 0
+        self._lock = threading.Lock()
+
+    @property
+    def exceeded(self) -> bool:
+        return self.spent + self.reserved >= self.max_tokens
+
+    def check(self):
+        if self.exceeded:
+            raise TokenBudgetExceeded(
+                f"Token budget of {self.name} spent: {self.spent} of {self.max_tokens}"
+                f" tokens, {self.reserved} reserved by calls in flight"
+            )
+
+    def reserve(self, tokens: int):
+        """Hold ``tokens`` for a call about to be issued, see `check`."""
+        with self._lock:
+            self.check()
+            self.reserved += tokens
+
+    def release(self, tokens: int):
+        with self._lock:
+            self.reserved -= tokens
+
+    def spend(self, tokens: int):
+        with self._lock:
+            self.spent += tokens
+
+
+@dataclass
+class UsageScope:
+    document: Optional[str] = None
+    question_set: Optional[str] = None
+    batch: Optional[str] = None
+    budget: Optional[TokenBudget] = None
+
+
+_scope: ContextVar[UsageScope] = ContextVar(
+    "legal_rag_usage_scope", default=UsageScope()
+)
+
+
+@contextmanager
+def usage_scope(**kwargs) -> Iterator[UsageScope]:
+    """
+    Label the calls made inside the block (``document``, ``question_set``,
+    ``batch``) and optionally limit them with a `TokenBudget`. Nested scopes
+    inherit what they do not set (or set to None).
+    """
+    current = _scope.get()
+    scope = UsageScope(
+        **{
+            field: getattr(current, field) if value is None else value
+            for field in UsageScope.__dataclass_fields__
+            for value in [kwargs.get(field)]
+        }
+    )
+    token = _scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _scope.reset(token)
+
+
+def current_scope() -> UsageScope:
+    return _scope.get()
+
+
+class UsageLedger:
+    """
+    Every call (cached or not) as a row of a SQLite table, so the usage can be
+    added up per document, question set, model or batch. Like `DiskCache`, a
+    connection is opened per operation and the file can be shared between
+    processes.
+    """
+
+    COLUMNS = (
+        "created",
+        "document",
+        "question_set",
+        "batch",
+        "model",
+        "prompt_tokens",
+        "completion_tokens",
+        "total_tokens",
+        "latency",
+        "retries",
+        "cached",
+        "estimated",
+    )
+    GROUPS = ("document", "question_set", "batch", "model")
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.path.join(cache_dir(), "usage.sqlite")
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS calls ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " created REAL NOT NULL,"
+                " document TEXT,"
+                " question_set TEXT,"
+                " batch TEXT,"
+                " model TEXT NOT NULL,"
+                " prompt_tokens INTEGER NOT NULL DEFAULT 0,"
+                " completion_tokens INTEGER NOT NULL DEFAULT 0,"
+                " total_tokens INTEGER NOT NULL DEFAULT 0,"
+                " latency REAL NOT NULL DEFAULT 0,"
+                " retries INTEGER NOT NULL DEFAULT 0,"
+                " cached INTEGER NOT NULL DEFAULT 0,"
+                " estimated INTEGER NOT NULL DEFAULT 0)"
+            )
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def record(
+        self,
+        model: str,
+        prompt_tokens: int = 0,
+        completion_tokens: int = 0,
+        latency: float = 0.0,
+        retries: int = 0,
+        cached: bool = False,
+        estimated: bool = False,
+        scope: Optional[UsageScope] = None,
+    ):
+        """Store a call, labelled and charged to the budget of ``scope`` (the current one by default)."""
+        scope = scope or current_scope()
+        total_tokens = prompt_tokens + completion_tokens
+        if scope.budget is not None:
+            scope.budget.spend(total_tokens)
+        row = (
+            time.time(),
+            scope.document,
+            scope.question_set,
+            scope.batch,
+            model,
+            prompt_tokens,
+            completion_tokens,
+            total_tokens,
+            latency,
+            retries,
+            int(cached),
+            int(estimated),
+        )
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    f"INSERT INTO calls ({', '.join(self.COLUMNS)})"
+                    f" VALUES ({', '.join('?' * len(self.COLUMNS))})",
+                    row,
+                )
+        except sqlite3.Error as e:
+            # losing a row of the ledger is not worth failing the answer
+            logging.warning(f"Could not record the usage of {model}: {e}")
+
+    def totals(self, by: str = "document", **filters) -> List[Dict]:
+        """
+        Calls, tokens, latency and retries grouped ``by`` one of `GROUPS`,
+        optionally filtered, e.g. ``totals("question_set", document="a.pdf")``.
+        """
+        if by not in self.GROUPS:
+            raise ValueError(f"Cannot group by {by}, use one of {self.GROUPS}")
+        unknown = set(filters) - set(self.GROUPS)
+        if unknown:
+            raise ValueError(f"Cannot filter by {unknown}, use {self.GROUPS}")
+
+        where = " AND ".join(f"{key} IS ?" for key in filters)
+        query = (
+            f"SELECT {by}, COUNT(*), SUM(cached), SUM(prompt_tokens),"
+            " SUM(completion_tokens), SUM(total_tokens),"
+            " AVG(CASE WHEN cached = 0 THEN latency END), SUM(retries)"
+            f" FROM calls {'WHERE ' + where if where else ''}"
+            f" GROUP BY {by} ORDER BY SUM(total_tokens) DESC"
+        )
+        with self._connect() as conn:
+            rows = conn.execute(query, tuple(filters.values())).fetchall()
+        keys = (
+            by,
+            "calls",
+            "cached",
+            "prompt_tokens",
+            "completion_tokens",
+            "total_tokens",
+            "mean_latency",
+            "retries",
+        )
+        return [dict(zip(keys, row)) for row in rows]
+
+
+_ledger = None
+_ledger_lock = threading.Lock()
+
+
+def get_usage_ledger() -> UsageLedger:
+    """Process-wide `UsageLedger`, created on first use."""
+    global _ledger
+    with _ledger_lock:
+        if _ledger is None:
+            _ledger = UsageLedger()
+        return _ledger
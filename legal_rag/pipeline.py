@@ -0,0 +1,196 @@
+"""From parsed pages to answers: section selection, context and LLM calls."""
+
+import asyncio
+import json
+import logging
+import uuid
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from langchain.prompts import PromptTemplate
+from legal_rag.contracts.parsing import ContractIndex, Section
+from legal_rag.contracts.prompts import Context, assemble_context, build_prompt
+from legal_rag.contracts.questions import (
+    AnswerSet,
+    Question,
+    all_questions,
+    kpis,
+    qa_parser,
+)
+from legal_rag.contracts.utils import select_index_section, select_index_sections
+from legal_rag.models.clients import get_client_manager
+from legal_rag.models.oai import DEFAULT_MODEL_NAME, async_oai_chain
+from legal_rag.models.usage import TokenBudget, TokenBudgetExceeded, usage_scope
+
+
+def select_section(
+    doc_index: ContractIndex, q_set_name: str, criteria="lexico"
+) -> Optional[Section]:
+    """Section of the index for a question set, KPIs are only looked for in annexes."""
+    raw_sections = [json.loads(s.model_dump_json()) for s in doc_index.sections]
+    if q_set_name == kpis.name:
+        raw_sections = [s for s in raw_sections if s["name"] in doc_index.annex_names]
+    if len(raw_sections) == 0:
+        return None
+    return Section(**select_index_section(raw_sections, q_set_name, criteria=criteria))
+
+
+def select_sections(
+    doc_index: ContractIndex, q_set_names: List[str], criteria="lexico"
+) -> Dict[str, Optional[Section]]:
+    """
+    `select_section` of several question sets, the document is routed to all
+    of them at once (see `select_index_sections`).
+    """
+    raw_sections = [json.loads(s.model_dump_json()) for s in doc_index.sections]
+    annex_sections = [s for s in raw_sections if s["name"] in doc_index.annex_names]
+    selected = {}
+    for names, candidates in (
+        ([name for name in q_set_names if name != kpis.name], raw_sections),
+        ([name for name in q_set_names if name == kpis.name], annex_sections),
+    ):
+        if len(names) > 0 and len(candidates) > 0:
+            selected.update(select_index_sections(candidates, names, criteria=criteria))
+    return {
+        name: Section(**selected[name]) if name in selected else None
+        for name in q_set_names
+    }
+
+
+def prepare_question_set(
+    pages,
+    doc_index: ContractIndex,
+    selected_questions: Question,
+    model_name=DEFAULT_MODEL_NAME,
+    criteria="lexico",
+    sections: Optional[Dict[str, Optional[Section]]] = None,
+    **context_kwargs,
+) -> Tuple[PromptTemplate, Optional[Context]]:
+    """
+    Build the prompt and the context to answer a question set. The context is
+    None when the contract has nothing to answer it with (no KPI annex).
+
+    ``sections`` are those chosen by `select_sections` for several question
+    sets, the section of a set missing from them is selected here.
+    """
+    _, format_instructions = qa_parser()
+    extraction_prompt = build_prompt(
+        selected_questions=selected_questions, format_instructions=format_instructions
+    )
+    if selected_questions.name == kpis.name and not doc_index.contains_kpi_annex:
+        return extraction_prompt, None
+
+    if sections is not None and selected_questions.name in sections:
+        selected_section = sections[selected_questions.name]
+    else:
+        selected_section = select_section(doc_index, selected_questions.name, criteria)
+    if selected_section is None:
+        return extraction_prompt, None
+
+    ctx = assemble_context(
+        selected_section=selected_section,
+        pages=pages,
+        selected_questions=selected_questions,
+        extraction_prompt=extraction_prompt,
+        model_name=model_name,
+        **context_kwargs,
+    )
+    return extraction_prompt, ctx
+
+
+async def iter_answer_sets(
+    pages,
+    doc_index: ContractIndex,
+    question_sets: Optional[List[Question]] = None,
+    model_name=DEFAULT_MODEL_NAME,
+    criteria="lexico",
+    max_concurrency: int = 4,
+    client=None,
+    document: Optional[str] = None,
+    token_budget: Optional[int] = None,
+    **context_kwargs,
+) -> AsyncIterator[Tuple[str, Optional[AnswerSet]]]:
+    """
+    Answer several question sets of a contract concurrently, yielding
+    ``(question set name, AnswerSet)`` as each completion finishes. A set
+    whose call fails is logged and yields None.
+
+    The contract is routed to the section of every question set at once (see
+    `select_sections`), then contexts are built in worker threads and at most
+    ``max_concurrency`` completions are in flight at once. Question sets
+    without a context yield None.
+
+    The calls are recorded in the `UsageLedger` under ``document`` and the
+    name of each question set. With ``token_budget`` no new call is made once
+    the batch has spent that many tokens, counting those reserved by the calls
+    in flight (see `TokenBudget`), the remaining sets yield None.
+    """
+    question_sets = question_sets or list(all_questions.values())
+    semaphore = asyncio.Semaphore(max_concurrency)
+    batch = uuid.uuid4().hex
+    budget = TokenBudget(token_budget, name=batch) if token_budget else None
+    sections = await asyncio.to_thread(
+        select_sections, doc_index, [q.name for q in question_sets], criteria
+    )
+
+    async def answer(selected_questions: Question):
+        with usage_scope(
+            document=document,
+            question_set=selected_questions.name,
+            batch=batch,
+            budget=budget,
+        ):
+            try:
+                return await answer_in_scope(selected_questions)
+            except Exception as e:
+                # a failed set does not take the answers of the others with it
+                logging.error(
+                    f"Could not answer {selected_questions.name}: {type(e).__name__}: {e}"
+                )
+                return selected_questions.name, None
+
+    async def answer_in_scope(selected_questions: Question):
+        extraction_prompt, ctx = await asyncio.to_thread(
+            prepare_question_set,
+            pages,
+            doc_index,
+            selected_questions,
+            model_name=model_name,
+            criteria=criteria,
+            sections=sections,
+            **context_kwargs,
+        )
+        if ctx is None:
+            logging.info(f"No context for {selected_questions.name}")
+            return selected_questions.name, None
+
+        async with semaphore:
+            logging.info(f"Answering {selected_questions.name} with {ctx.section_name}")
+            try:
+                response = await async_oai_chain(
+                    extraction_prompt, ctx, model_name=model_name, client=client
+                )
+            except TokenBudgetExceeded as e:
+                logging.warning(f"Skipping {selected_questions.name}: {e}")
+                return selected_questions.name, None
+        return selected_questions.name, response
+
+    async with get_client_manager().async_session():
+        tasks = [asyncio.create_task(answer(q)) for q in question_sets]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            # the caller may stop iterating early
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def answer_question_sets(
+    pages, doc_index: ContractIndex, **kwargs
+) -> Dict[str, Optional[AnswerSet]]:
+    """All the answers of `iter_answer_sets`, by question set name."""
+    return {
+        name: answer
+        async for name, answer in iter_answer_sets(pages, doc_index, **kwargs)
+    }
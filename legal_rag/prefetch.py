@@ -0,0 +1,139 @@
+"""Background parsing of a document and speculative preparation of its contexts."""
+
+import logging
+import threading
+import time
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+from legal_rag import tracing
+from legal_rag.contracts.questions import Question
+
+
+class DocumentPrefetcher:
+    """
+    Parse a document in a worker thread and, once its index is available,
+    prepare the prompt and context of every question set, so picking any of
+    them does not wait for section selection or retrieval.
+
+    ``parse_fn()`` returns ``(pages, doc_index)``, ``prepare_fn(pages,
+    doc_index, question_set)`` returns ``(prompt, context)`` and the optional
+    ``prewarm_fn(prompt, context)`` is called with each prepared context, e.g.
+    to fill the response cache. With ``route_fn(doc_index, question_set_names)``
+    the document is routed to all the question sets at once after parsing (see
+    `pipeline.select_sections`), and its result is passed to ``prepare_fn`` as
+    ``sections``. Work still queued is dropped by `cancel`; a step that already
+    started runs to completion, but its results are ignored.
+    """
+
+    def __init__(
+        self,
+        parse_fn: Callable,
+        prepare_fn: Callable,
+        question_sets: List[Question],
+        prewarm_fn: Optional[Callable] = None,
+        max_workers: int = 2,
+        route_fn: Optional[Callable] = None,
+    ):
+        self.parse_fn = parse_fn
+        self.prepare_fn = prepare_fn
+        self.question_sets = {q.name: q for q in question_sets}
+        self.prewarm_fn = prewarm_fn
+        self.route_fn = route_fn
+        self._sections: Optional[Dict] = None
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="prefetch"
+        )
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._contexts: Dict[str, Future] = {}
+        self._parsed: Optional[Future] = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def start(self) -> "DocumentPrefetcher":
+        self._parsed = self._executor.submit(self._parse)
+        self._parsed.add_done_callback(self._schedule_contexts)
+        return self
+
+    def _parse(self):
+        s_time = time.time()
+        with tracing.request("parse_document"):
+            results = self.parse_fn()
+            if self.route_fn is not None:
+                _, doc_index = results
+                try:
+                    self._sections = self.route_fn(doc_index, list(self.question_sets))
+                except Exception as e:
+                    # each question set is routed on its own then
+                    logging.warning(f"Could not route the document: {e}")
+        logging.info(f"Background parsing took {time.time() - s_time:.2f}s")
+        return results
+
+    def _schedule_contexts(self, parsed: Future):
+        if self.cancelled or parsed.cancelled() or parsed.exception() is not None:
+            return
+        with self._lock:
+            for name in self.question_sets:
+                if name in self._contexts:
+                    continue
+                try:
+                    self._contexts[name] = self._executor.submit(self._prepare, name)
+                except RuntimeError:
+                    # the executor was shut down by cancel
+                    return
+
+    def _prepare(self, name: str):
+        if self.cancelled:
+            raise CancelledError()
+        pages, doc_index = self.parsed()
+        with tracing.request("prepare_question_set", question_set=name):
+            kwargs = {} if self._sections is None else {"sections": self._sections}
+            prompt, ctx = self.prepare_fn(
+                pages, doc_index, self.question_sets[name], **kwargs
+            )
+        logging.info(f"Prefetched context for {name}")
+        if self.prewarm_fn is not None and ctx is not None and not self.cancelled:
+            try:
+                self.prewarm_fn(prompt, ctx)
+            except Exception as e:
+                logging.warning(f"Could not prewarm {name}: {e}")
+        return prompt, ctx
+
+    @property
+    def parsing(self) -> bool:
+        return self._parsed is not None and not self._parsed.done()
+
+    def parsed(self, timeout: Optional[float] = None) -> Tuple:
+        """``(pages, doc_index)`` of the document, waiting for the parsing to finish."""
+        return self._parsed.result(timeout)
+
+    def context(self, question_set: Question, timeout: Optional[float] = None):
+        """
+        ``(prompt, context)`` of a question set. If its preparation was not
+        picked up by a worker yet, it is done right away in the caller.
+        """
+        pages, doc_index = self.parsed(timeout)
+        with self._lock:
+            future = self._contexts.get(question_set.name)
+            if future is None or future.cancel():
+                self.question_sets.setdefault(question_set.name, question_set)
+                future = Future()
+                self._contexts[question_set.name] = future
+                run_here = True
+            else:
+                run_here = False
+
+        if run_here:
+            try:
+                future.set_result(self._prepare(question_set.name))
+            except BaseException as e:
+                future.set_exception(e)
+        return future.result(timeout)
+
+    def cancel(self):
+        """Drop the pending work, e.g. because another document was uploaded."""
+        self._cancelled.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,257 @@
+import hashlib
+import io
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pytest
+from legal_rag.tests.synthetic import generate_contract
+
+# page counts of the synthetic contracts, e.g. LEGAL_RAG_BENCH_SIZES=10,100,1000
+BENCH_SIZES = [int(n) for n in os.getenv("LEGAL_RAG_BENCH_SIZES", "10,100").split(",")]
+# entries of the index of `large_index_contract`, in a contract long enough
+# for all of them to have their own page
+LARGE_INDEX_SECTIONS = 2000
+
+
+class UploadedPDF(io.BytesIO):
+    """Stands in for streamlit's `UploadedFile`."""
+
+    type = "application/pdf"
+
+    def __init__(self, data: bytes, name: str):
+        super().__init__(data)
+        self.name = name
+
+
+class StubEmbeddingModel:
+    """Deterministic embeddings from the character trigrams, instead of a transformer."""
+
+    dim = 256
+
+    def encode(self, texts, batch_size=32, convert_to_numpy=True, **kwargs):
+        embeddings = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for j in range(len(text) - 2):
+                h = hashlib.md5(text[j : j + 3].encode()).digest()
+                embeddings[i, int.from_bytes(h[:4], "little") % self.dim] += 1
+        return embeddings
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    """
+    Chat completions of an OpenAI compatible API, with the ``answers`` of the
+    server as `AnswerSet`, streamed in small chunks when asked to.
+    """
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status: int, body: dict, headers=()):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for header in headers:
+            self.send_header(*header)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with self.server.lock:
+            self.server.requests.append(request)
+            rate_limited = self.server.failures > 0
+            self.server.failures -= int(rate_limited)
+        if rate_limited:
+            error = {"error": {"message": "Rate limit reached"}}
+            self.send_json(429, error, [("Retry-After", "0")])
+            return
+
+        arguments = json.dumps({"answers": self.server.answers})
+        if request.get("stream"):
+            self.send_stream(request, arguments)
+            return
+
+        call = {"name": "AnswerSet", "arguments": arguments}
+        message = {
+            "role": "assistant",
+            "content": None,
+            "function_call": call,
+            "tool_calls": [{"id": "call_0", "type": "function", "function": call}],
+        }
+        usage = {"prompt_tokens": 100, "completion_tokens": 20, "total_tokens": 120}
+        self.send_json(
+            200,
+            {
+                "id": f"chatcmpl-{len(self.server.requests)}",
+                "object": "chat.completion",
+                "created": 0,
+                "model": request["model"],
+                "choices": [{"index": 0, "finish_reason": "stop", "message": message}],
+                "usage": usage,
+            },
+        )
+
+    def send_stream(self, request: dict, arguments: str, chunk_chars: int = 7):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        for start in range(0, len(arguments), chunk_chars):
+            part = arguments[start : start + chunk_chars]
+            delta = {"function_call": {"arguments": part}}
+            chunk = {
+                "id": f"chatcmpl-{len(self.server.requests)}",
+                "object": "chat.completion.chunk",
+                "created": 0,
+                "model": request["model"],
+                "choices": [{"index": 0, "delta": delta, "finish_reason": None}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        self.wfile.write(b"data: [DONE]\n\n")
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    """Local `FakeOpenAIHandler`, answering ``failures`` requests with a 429 first."""
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FakeOpenAIHandler)
+        self.requests = []
+        self.failures = 0
+        self.answers = [{"text": "Respuesta", "is_answered": True}]
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}/v1"
+
+
+@pytest.fixture
+def fake_openai(monkeypatch, tmp_path):
+    """`FakeOpenAIServer` behind the OpenAI clients, with an empty response cache."""
+    from legal_rag.models import cache, clients
+
+    server = FakeOpenAIServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setenv("OPENAI_BASE_URL", server.base_url)
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr(clients, "_manager", None)
+    monkeypatch.setattr(
+        cache, "_default_cache", cache.ResponseCache(str(tmp_path / "responses.sqlite"))
+    )
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+@pytest.fixture(scope="session", autouse=True)
+def cache_dir(tmp_path_factory):
+    """Keep the on-disk caches of the tests away from the user's."""
+    path = tmp_path_factory.mktemp("cache")
+    previous = os.environ.get("LEGAL_RAG_CACHE_DIR")
+    os.environ["LEGAL_RAG_CACHE_DIR"] = str(path)
+    yield path
+    if previous is None:
+        os.environ.pop("LEGAL_RAG_CACHE_DIR")
+    else:
+        os.environ["LEGAL_RAG_CACHE_DIR"] = previous
+
+
+@pytest.fixture(scope="session", params=BENCH_SIZES, ids=lambda n: f"{n}p")
+def contract(request):
+    return generate_contract(request.param, language="es")
+
+
+@pytest.fixture
+def upload(contract):
+    return UploadedPDF(contract.pdf, f"contract_{contract.n_pages}p.pdf")
+
+
+@pytest.fixture(scope="session")
+def pages(contract):
+    """All the pages of the contract, extracted once per session."""
+    from legal_rag.loaders.pdfminer import PDFMinerReader
+
+    reader = PDFMinerReader(UploadedPDF(contract.pdf, "contract.pdf"))
+    return reader.load_data()
+
+
+@pytest.fixture(scope="session")
+def pages_without_index(contract, pages):
+    """The pages of the contract with its index pages left blank."""
+    from langchain_core.documents import Document
+
+    return [
+        (
+            Document(page_content="", metadata=page.metadata)
+            if page.metadata["page"] in contract.index_pages
+            else page
+        )
+        for page in pages
+    ]
+
+
+@pytest.fixture(scope="session")
+def outline_pages_without_index(contract):
+    """
+    The pages of the contract extracted with their layout, with its index
+    pages left blank.
+    """
+    from langchain_core.documents import Document
+    from legal_rag.loaders.pdfminer import PDFMinerReader
+
+    reader = PDFMinerReader(
+        UploadedPDF(contract.pdf, "contract.pdf"), backend="pdfminer-outline"
+    )
+    return [
+        (
+            Document(page_content="", metadata={**page.metadata, "layout": None})
+            if page.metadata["page"] in contract.index_pages
+            else page
+        )
+        for page in reader.load_data()
+    ]
+
+
+@pytest.fixture(scope="session")
+def large_index_contract():
+    return generate_contract(
+        LARGE_INDEX_SECTIONS + 300, language="es", n_sections=LARGE_INDEX_SECTIONS
+    )
+
+
+@pytest.fixture(scope="session")
+def large_index_pages(large_index_contract):
+    """
+    Lazy pages of `large_index_contract` with the index pages (and the first
+    body page) already extracted, the rest of the body is never read.
+    """
+    from legal_rag.loaders.pdfminer import PDFMinerReader
+
+    reader = PDFMinerReader(UploadedPDF(large_index_contract.pdf, "contract.pdf"))
+    pages = reader.load_lazy()
+    pages[: large_index_contract.index_pages[-1] + 2]
+    return pages
+
+
+@pytest.fixture(scope="session")
+def doc_index(pages):
+    from legal_rag.contracts.parsing import index_parser
+
+    return index_parser(pages)
+
+
+@pytest.fixture
+def stub_embeddings(monkeypatch):
+    """Semantic selection with `StubEmbeddingModel`, nothing is downloaded."""
+    from legal_rag.contracts import utils
+    from legal_rag.contracts.embeddings import EmbeddingService
+
+    service = EmbeddingService("stub")
+    service._model = StubEmbeddingModel()
+    monkeypatch.setattr(utils, "get_embedding_service", lambda *args, **kwargs: service)
+    return service
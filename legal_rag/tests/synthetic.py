@@ -0,0 +1,264 @@
+"""
+Synthetic contract PDFs for tests and benchmarks.
+
+The contracts follow the layout of the ones we parse: a title page, an index
+with dotted leaders ("Alcance de los servicios ........ 5") whose page numbers
+start at the first page after the index, the body with a heading at the start
+of every section, and annexes at the end, one of them with the KPIs.
+
+The PDF is written by hand (standard Helvetica fonts, WinAnsi encoding), so
+generating a 1,000 page contract does not need any PDF library.
+
+    python -m legal_rag.tests.synthetic contract.pdf --pages 100 --language en
+"""
+
+import argparse
+import math
+import zlib
+from dataclasses import dataclass, field
+from typing import List, Tuple
+
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842
+INDEX_ENTRIES_PER_PAGE = 22
+
+SECTION_NAMES = {
+    "es": [
+        "Especificaciones del contrato",
+        "Alcance de los servicios",
+        "Precio y forma de pago",
+        "Terminación Contrato",
+        "No conformidades",
+    ],
+    "en": [
+        "Contract Specifics",
+        "Scope of Services",
+        "Price and Payment",
+        "Ending this Contract",
+        "Non Conformities",
+    ],
+}
+FILLER_NAME = {"es": "Disposiciones generales {}", "en": "General provisions {}"}
+ANNEX_NAMES = {
+    "es": [
+        "Anexo A - Indicadores Clave de Desempeño",
+        "Anexo B - Seguros",
+    ],
+    "en": [
+        "Schedule A - Key Performance Indicators",
+        "Schedule B - Insurance",
+    ],
+}
+TITLE = {"es": "CONTRATO DE SERVICIOS MINEROS", "en": "MINING SERVICES CONTRACT"}
+INDEX_TITLE = {"es": "ÍNDICE", "en": "INDEX"}
+CLAUSE = {
+    "es": "Cláusula {}.{}.{} El Contratista deberá prestar los servicios según lo pactado en la página {}.",
+    "en": "Clause {}.{}.{} The Contractor shall perform the services as agreed on page {}.",
+}
+KPI = {
+    "es": "Indicador {}: disponibilidad de equipos mayor o igual a {}% medida mensualmente.",
+    "en": "Indicator {}: equipment availability greater than or equal to {}% measured monthly.",
+}
+
+
+@dataclass
+class SyntheticContract:
+    pdf: bytes
+    n_pages: int
+    language: str
+    # (name, 0-based page where the section starts)
+    sections: List[Tuple[str, int]] = field(default_factory=list)
+    annex_names: List[str] = field(default_factory=list)
+    # 0-based pages of the index
+    index_pages: List[int] = field(default_factory=list)
+
+    @property
+    def kpi_annex(self) -> str:
+        return self.annex_names[0]
+
+
+def _pdf_string(text: str) -> bytes:
+    data = text.encode("cp1252")
+    return (
+        b"("
+        + data.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+        + b")"
+    )
+
+
+class _PDFWriter:
+    """Just enough of PDF to write pages of text lines."""
+
+    FONTS = {"F1": "Helvetica", "F2": "Helvetica-Bold"}
+
+    def __init__(self):
+        self.pages: List[bytes] = []
+
+    def add_page(self, lines: List[Tuple[str, int, int, str]]):
+        """Add a page with ``(font, size, y, text)`` lines, all starting at x=72."""
+        ops = []
+        for font, size, y, text in lines:
+            ops.append(
+                b"BT /%s %d Tf 72 %d Td %s Tj ET"
+                % (font.encode(), size, y, _pdf_string(text))
+            )
+        self.pages.append(b"\n".join(ops))
+
+    def write(self) -> bytes:
+        n_pages = len(self.pages)
+        font_ids = {name: 3 + i for i, name in enumerate(self.FONTS)}
+        first_page_id = 3 + len(self.FONTS)
+        page_ids = [first_page_id + 2 * i for i in range(n_pages)]
+
+        objects = {
+            1: b"<< /Type /Catalog /Pages 2 0 R >>",
+            2: b"<< /Type /Pages /Kids [%s] /Count %d >>"
+            % (b" ".join(b"%d 0 R" % i for i in page_ids), n_pages),
+        }
+        for name, base_font in self.FONTS.items():
+            objects[font_ids[name]] = (
+                b"<< /Type /Font /Subtype /Type1 /BaseFont /%s /Encoding /WinAnsiEncoding >>"
+                % base_font.encode()
+            )
+        fonts = b" ".join(
+            b"/%s %d 0 R" % (name.encode(), i) for name, i in font_ids.items()
+        )
+        for page_id, content in zip(page_ids, self.pages):
+            objects[page_id] = (
+                b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] "
+                b"/Resources << /Font << %s >> >> /Contents %d 0 R >>"
+                % (PAGE_WIDTH, PAGE_HEIGHT, fonts, page_id + 1)
+            )
+            stream = zlib.compress(content)
+            objects[page_id + 1] = (
+                b"<< /Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream"
+                % (len(stream), stream)
+            )
+
+        out = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        offsets = []
+        for i in range(1, len(objects) + 1):
+            offsets.append(len(out))
+            out += b"%d 0 obj\n%s\nendobj\n" % (i, objects[i])
+        xref = len(out)
+        out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+        out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+        out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+            len(objects) + 1,
+            xref,
+        )
+        return bytes(out)
+
+
+def _body_page(language: str, body_page: int, heading: str = None, kpis: bool = False):
+    lines, y = [], 780
+    if heading is not None:
+        lines.append(("F2", 14, y, heading.upper()))
+        y -= 40
+    for paragraph in range(6):
+        for line in range(4):
+            if kpis:
+                text = KPI[language].format(4 * paragraph + line + 1, 90 + line)
+            else:
+                text = CLAUSE[language].format(body_page, paragraph, line, body_page)
+            lines.append(("F1", 10, y, text))
+            y -= 14
+        y -= 14
+        if y < 72:
+            break
+    return lines
+
+
+def generate_contract(
+    n_pages: int = 100, language: str = "es", n_sections: int = None
+) -> SyntheticContract:
+    """
+    Contract of ``n_pages`` pages in ``language`` ("es" or "en"). By default
+    it has a section every 10 pages or so, besides the usual ones and the
+    annexes.
+    """
+    if language not in SECTION_NAMES:
+        raise ValueError(
+            f"Language {language} not supported, use one of {list(SECTION_NAMES)}"
+        )
+
+    core, annexes = SECTION_NAMES[language], ANNEX_NAMES[language]
+    n_sections = n_sections or max(len(core) + len(annexes), n_pages // 10)
+    n_fillers = max(0, n_sections - len(core) - len(annexes))
+    names = (
+        core + [FILLER_NAME[language].format(k + 1) for k in range(n_fillers)] + annexes
+    )
+    n_index_pages = math.ceil(len(names) / INDEX_ENTRIES_PER_PAGE)
+    n_body = n_pages - 1 - n_index_pages
+    if n_body < len(names):
+        raise ValueError(f"{n_pages} pages are not enough for {len(names)} sections")
+
+    # 1-based body pages where each section starts, as written in the index
+    starts = [1 + (k * n_body) // len(names) for k in range(len(names))]
+    first_body_page = 1 + n_index_pages
+
+    writer = _PDFWriter()
+    writer.add_page([("F2", 18, 750, TITLE[language])])
+    for p in range(n_index_pages):
+        lines, y = [], 780
+        if p == 0:
+            lines.append(("F1", 11, y, INDEX_TITLE[language]))
+            y -= 40
+        entries = range(
+            p * INDEX_ENTRIES_PER_PAGE,
+            min((p + 1) * INDEX_ENTRIES_PER_PAGE, len(names)),
+        )
+        for k in entries:
+            lines.append(
+                ("F1", 11, y, f"{k + 1}. {names[k]} " + "." * 40 + f" {starts[k]}")
+            )
+            y -= 30
+        writer.add_page(lines)
+
+    headings = dict(zip(starts, names))
+    kpi_start = starts[-len(annexes)]
+    kpi_end = starts[-len(annexes) + 1]
+    for body_page in range(1, n_body + 1):
+        writer.add_page(
+            _body_page(
+                language,
+                body_page,
+                heading=headings.get(body_page),
+                kpis=kpi_start <= body_page < kpi_end,
+            )
+        )
+
+    return SyntheticContract(
+        pdf=writer.write(),
+        n_pages=n_pages,
+        language=language,
+        sections=[
+            (name, first_body_page + start - 1) for name, start in zip(names, starts)
+        ],
+        annex_names=list(annexes),
+        index_pages=list(range(1, first_body_page)),
+    )
+
+
+def write_contract(
+    path: str, n_pages: int = 100, language: str = "es"
+) -> SyntheticContract:
+    contract = generate_contract(n_pages, language=language)
+    with open(path, "wb") as f:
+        f.write(contract.pdf)
+    return contract
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic contract PDF.")
+    parser.add_argument("path")
+    parser.add_argument("--pages", type=int, default=100)
+    parser.add_argument("--language", choices=list(SECTION_NAMES), default="es")
+    args = parser.parse_args()
+    contract = write_contract(args.path, args.pages, args.language)
+    print(
+        f"Wrote {contract.n_pages} pages and {len(contract.sections)} sections to {args.path}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Benchmarks of the parsing pipeline on synthetic contracts of 10 and 100
+pages, and 1,000 with LEGAL_RAG_BENCH_SIZES (see `conftest.BENCH_SIZES`).
+Every benchmark also checks its result, so a faster but wrong change fails
+here too. They are skipped unless pytest runs with ``--benchmark-only``.
+"""
+
+import json
+
+import pytest
+from legal_rag.contracts.locator import (
+    OUTLINE_PAGE_BUDGET,
+    locate_sections,
+    outline_index,
+)
+from legal_rag.contracts.parsing import index_parser
+from legal_rag.contracts.prompts import build_context
+from legal_rag.contracts.questions import alcances, all_questions
+from legal_rag.contracts.utils import select_index_section
+from legal_rag.loaders import parse_pdf
+from legal_rag.loaders.pdfminer import PDFMinerReader
+from legal_rag.pipeline import select_section, select_sections
+
+
+def rounds(contract) -> int:
+    """Fewer rounds for the larger contracts, so the suite runs in minutes."""
+    return max(1, min(10, 300 // contract.n_pages))
+
+
+def raw_sections(doc_index):
+    return [json.loads(s.model_dump_json()) for s in doc_index.sections]
+
+
+def test_load_data(benchmark, contract, upload):
+    reader = PDFMinerReader(upload)
+    pages = benchmark.pedantic(reader.load_data, rounds=rounds(contract))
+    assert len(pages) == contract.n_pages
+
+
+def test_parse_pdf(benchmark, contract, upload):
+    pages, doc_index = benchmark.pedantic(
+        lambda: parse_pdf(upload, use_cache=False)[:2], rounds=rounds(contract)
+    )
+    assert len(pages) == contract.n_pages
+    assert [(s.name, s.start_page) for s in doc_index.sections] == contract.sections
+
+
+def test_index_parser(benchmark, contract, pages):
+    doc_index = benchmark(index_parser, pages)
+    assert [(s.name, s.start_page) for s in doc_index.sections] == contract.sections
+    assert doc_index.annex_names == contract.annex_names
+    assert doc_index.contains_kpi_annex
+
+
+def test_index_parser_large_index(benchmark, large_index_contract, large_index_pages):
+    doc_index = benchmark(index_parser, large_index_pages)
+    assert [
+        (s.name, s.start_page) for s in doc_index.sections
+    ] == large_index_contract.sections
+    assert large_index_pages.n_extracted == len(large_index_contract.index_pages) + 2
+    # sections end 4 pages past the (1-based) start of the next one
+    last_page = large_index_contract.n_pages - 1
+    for section, next_section in zip(doc_index.sections, doc_index.sections[1:]):
+        assert section.end_page == min(next_section.start_page + 1 + 4, last_page)
+    assert doc_index.sections[-1].end_page == last_page
+
+
+def test_locate_sections(benchmark, contract, pages_without_index):
+    doc_index = benchmark(locate_sections, pages_without_index)
+    # only the sections whose headings are keywords are found
+    expected = [
+        (name.upper(), start)
+        for name, start in contract.sections
+        if name.startswith(
+            ("Especificaciones", "Alcance", "Terminación", "No ", "Anexo")
+        )
+    ]
+    assert [(s.name, s.start_page) for s in doc_index.sections] == expected
+    assert doc_index.annex_names == [name.upper() for name in contract.annex_names]
+    assert doc_index.contains_kpi_annex
+    section = select_index_section(
+        raw_sections(doc_index), "Alcance de Servicios", criteria="lexico"
+    )
+    assert section["name"] == "ALCANCE DE LOS SERVICIOS"
+
+
+def test_outline_index(benchmark, contract, outline_pages_without_index):
+    doc_index = benchmark(outline_index, outline_pages_without_index)
+    # every heading is in the outline, the title of the contract is not
+    assert [(s.name, s.start_page) for s in doc_index.sections] == [
+        (name.upper(), start) for name, start in contract.sections
+    ]
+    assert doc_index.contains_kpi_annex
+
+
+def test_outline_index_lazy(benchmark, contract, upload):
+    """The outline of lazy pages extracts at most `OUTLINE_PAGE_BUDGET` pages."""
+
+    def setup():
+        reader = PDFMinerReader(upload, backend="pdfminer-outline")
+        return (reader.load_lazy(),), {}
+
+    extracted = []
+
+    def run(pages):
+        doc_index = outline_index(pages)
+        extracted.append(pages.n_extracted)
+        return doc_index
+
+    doc_index = benchmark.pedantic(run, setup=setup, rounds=rounds(contract))
+    assert max(extracted) == min(OUTLINE_PAGE_BUDGET, contract.n_pages)
+    assert doc_index.sections[0].name == contract.sections[0][0].upper()
+    # the annexes, past the budget, are located by keywords
+    assert doc_index.contains_kpi_annex
+    assert len(doc_index.annex_names) == len(contract.annex_names)
+
+
+def test_select_index_section_lexico(benchmark, doc_index):
+    section = benchmark(
+        select_index_section,
+        raw_sections(doc_index),
+        "Alcance de Servicios",
+        criteria="lexico",
+    )
+    assert section["name"] == "Alcance de los servicios"
+
+
+def test_select_index_section_semantica(benchmark, doc_index, stub_embeddings):
+    sections = raw_sections(doc_index)
+    section = benchmark(
+        select_index_section, sections, "Alcance de Servicios", criteria="semantica"
+    )
+    assert section in sections
+
+
+def test_select_sections(benchmark, doc_index):
+    names = list(all_questions)
+    sections = benchmark(select_sections, doc_index, names)
+    assert sections == {name: select_section(doc_index, name) for name in names}
+
+
+@pytest.mark.parametrize(
+    "selected_questions", [None, alcances], ids=["truncate", "bm25"]
+)
+def test_build_context(benchmark, pages, doc_index, selected_questions):
+    section = doc_index.sections[1]
+    ctx = benchmark(
+        build_context, section, pages, selected_questions=selected_questions
+    )
+    assert ctx.section_name == section.name
+    assert len(ctx.str_context) > 0
+    assert set(ctx.pages_used) <= set(range(section.start_page, section.end_page))
@@ -0,0 +1,22 @@
+"""The batch ingestion fills the same cache the app reads."""
+
+from legal_rag import cli
+from legal_rag.loaders import parse_pdf, pdfminer
+from legal_rag.tests.conftest import UploadedPDF
+
+
+def test_cached_ingestion_is_a_parse_pdf_hit(tmp_path, monkeypatch, contract):
+    path = tmp_path / "contract.pdf"
+    path.write_bytes(contract.pdf)
+    record = cli.ingest_file(str(path), cli.AUTO_BACKEND, use_cache=True)
+    assert record["status"] == "ok", record.get("error")
+
+    def parse_contract_index(pages):
+        raise AssertionError("the index was parsed again instead of read from the cache")
+
+    monkeypatch.setattr(pdfminer, "parse_contract_index", parse_contract_index)
+    upload = UploadedPDF(contract.pdf, "contract.pdf")
+    # as in app.py
+    pages, contract_index = parse_pdf(upload, backend="auto")[:2]
+    assert pages.n_cached == contract.n_pages
+    assert contract_index.model_dump() == record["contract_index"]
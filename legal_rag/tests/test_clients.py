@@ -0,0 +1,22 @@
+"""Rate limits of the `ClientManager`."""
+
+import pytest
+from legal_rag.models.clients import DEFAULT_RATE_LIMIT, MODEL_RATE_LIMITS, ClientManager
+
+
+def test_rate_limits_are_overridden(monkeypatch):
+    monkeypatch.setenv("LEGAL_RAG_RATE_LIMITS", "gpt-4=500:40000, gpt-4-32k=10:1000")
+    manager = ClientManager(api_key="test", rate_limits={"gpt-4-32k": (20, 2_000)})
+
+    assert manager.limiter("gpt-4").tokens.capacity == 40_000
+    assert manager.limiter("gpt-4-32k").requests.capacity == 20
+    assert manager.limiter("gpt-4-32k").tokens.capacity == 2_000
+    rpm, tpm = MODEL_RATE_LIMITS["gpt-3.5-turbo"]
+    assert manager.limiter("gpt-3.5-turbo").tokens.capacity == tpm
+    assert manager.limiter("other-model").tokens.capacity == DEFAULT_RATE_LIMIT[1]
+
+
+def test_invalid_rate_limits_are_rejected(monkeypatch):
+    monkeypatch.setenv("LEGAL_RAG_RATE_LIMITS", "gpt-4=500")
+    with pytest.raises(ValueError, match="gpt-4=500"):
+        ClientManager(api_key="test")
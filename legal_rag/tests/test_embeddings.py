@@ -0,0 +1,88 @@
+"""The `EmbeddingService` loads its model once and reuses what it encodes."""
+
+import sys
+import types
+
+import numpy as np
+import pytest
+from legal_rag.cache import DiskCache
+from legal_rag.contracts import embeddings
+from legal_rag.contracts.embeddings import EmbeddingService, get_embedding_service
+from legal_rag.contracts.utils import diccionario_keywords
+from legal_rag.tests.conftest import StubEmbeddingModel
+
+
+class CountingModel(StubEmbeddingModel):
+    """`StubEmbeddingModel` recording the texts it encodes."""
+
+    def __init__(self, *args, **kwargs):
+        self.encoded = []
+
+    def encode(self, texts, **kwargs):
+        self.encoded.extend(texts)
+        return super().encode(texts, **kwargs)
+
+
+@pytest.fixture
+def loaded_models(monkeypatch):
+    """Models loaded through ``sentence_transformers.SentenceTransformer``."""
+    models = []
+
+    def SentenceTransformer(model_name):
+        models.append(CountingModel())
+        return models[-1]
+
+    module = types.ModuleType("sentence_transformers")
+    module.SentenceTransformer = SentenceTransformer
+    monkeypatch.setitem(sys.modules, "sentence_transformers", module)
+    monkeypatch.setattr(embeddings, "_services", {})
+    return models
+
+
+def test_model_stays_loaded(loaded_models):
+    service = get_embedding_service("stub", persist=False)
+    assert loaded_models == []
+
+    service.encode_titles(["Precio"])
+    get_embedding_service("stub", persist=False).encode_titles(["Vigencia"])
+    assert get_embedding_service("stub", persist=False) is service
+    assert len(loaded_models) == 1
+
+
+def test_keyword_embeddings_are_memoized(loaded_models):
+    service = EmbeddingService("stub")
+    service.warmup(diccionario_keywords)
+    (model,) = loaded_models
+    assert len(model.encoded) == sum(len(kws) for kws in diccionario_keywords.values())
+
+    model.encoded.clear()
+    for q_set_name, keywords in diccionario_keywords.items():
+        np.testing.assert_array_equal(
+            service.keyword_embeddings(q_set_name, keywords),
+            model.encode([kw.lower() for kw in keywords]),
+        )
+        model.encoded.clear()
+        service.keyword_embeddings(q_set_name, keywords)
+        assert model.encoded == []
+
+    # other keywords for the same set are not served from the memo
+    service.keyword_embeddings(q_set_name, ["Otra sección"])
+    assert model.encoded == ["otra sección"]
+
+
+def test_titles_are_stored_on_disk(loaded_models, tmp_path):
+    store = DiskCache(str(tmp_path / "embeddings.sqlite"))
+    titles = ["Alcance de los Servicios", "ALCANCE  DE LOS  SERVICIOS", "Precio"]
+    first = EmbeddingService("stub", store=store).encode_titles(titles)
+    assert loaded_models[0].encoded == ["alcance de los servicios", "precio"]
+    np.testing.assert_array_equal(first[0], first[1])
+
+    # a new process, with an empty memo, reads them back without the model
+    service = EmbeddingService("stub", store=DiskCache(store.path))
+    np.testing.assert_array_equal(service.encode_titles(titles), first)
+    assert len(loaded_models) == 1
+    assert service.store.hits == 2
+
+    # titles are stored per model
+    EmbeddingService("other", store=store).encode_titles(titles)
+    assert loaded_models[1].encoded == ["alcance de los servicios", "precio"]
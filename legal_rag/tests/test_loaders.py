@@ -0,0 +1,25 @@
+"""Cache hits of `parse_pdf` give the same pages as the parsing they replace."""
+
+from legal_rag.contracts.locator import outline_index
+from legal_rag.loaders import parse_pdf, update_parsed_pdf_cache
+from legal_rag.tests.conftest import UploadedPDF
+
+
+def test_cache_hit_keeps_the_layout(contract):
+    upload = UploadedPDF(contract.pdf, "outline.pdf")
+    pages = parse_pdf(upload, backend="pdfminer-outline")[0]
+    parsed = outline_index(pages)
+    # as in app.py, the pages extracted after parse_pdf are added to the cache
+    update_parsed_pdf_cache(pages, parsed)
+    layouts = pages.page_layouts()
+    assert layouts
+
+    upload = UploadedPDF(contract.pdf, "outline.pdf")
+    cached_pages = parse_pdf(upload, backend="pdfminer-outline")[0]
+    assert cached_pages.n_cached == len(layouts)
+    assert cached_pages.page_layouts().keys() == layouts.keys()
+    # the cached pages do not count against the page budget of the outline,
+    # so it can only find more sections
+    sections = {s.name: s for s in outline_index(cached_pages).sections}
+    for section in parsed.sections:
+        assert sections[section.name].start_page == section.start_page
@@ -0,0 +1,90 @@
+"""The question sets of a contract answered end to end, against `FakeOpenAIServer`."""
+
+import asyncio
+from types import SimpleNamespace
+
+from legal_rag.contracts.questions import all_questions
+from legal_rag.models import cache
+from legal_rag.models.oai import stream_answers
+from legal_rag.models.usage import get_usage_ledger, usage_scope
+from legal_rag.pipeline import answer_question_sets
+
+
+def test_answer_question_sets(fake_openai, contract, pages, doc_index):
+    document = f"contract_{contract.n_pages}p.pdf"
+    fake_openai.failures = 1
+
+    answers = asyncio.run(answer_question_sets(pages, doc_index, document=document))
+
+    assert set(answers) == set(all_questions)
+    for name, answer_set in answers.items():
+        assert answer_set is not None, name
+        assert [a.text for a in answer_set.answers] == ["Respuesta"]
+    # every set is asked once, plus the retry of the rate limited request
+    assert len(fake_openai.requests) == len(all_questions) + 1
+    prompts = [r["messages"][0]["content"] for r in fake_openai.requests]
+    for question_set in all_questions.values():
+        assert any(question_set.json() in prompt for prompt in prompts)
+
+    totals = get_usage_ledger().totals("question_set", document=document)
+    assert {row["question_set"] for row in totals} == set(all_questions)
+    assert sum(row["total_tokens"] for row in totals) == 120 * len(all_questions)
+    assert sum(row["retries"] for row in totals) == 1
+
+
+def test_stream_answers_skips_invalid_items(fake_openai):
+    fake_openai.answers = [
+        {"text": "Primera", "is_answered": True},
+        {"is_answered": True},
+        {"text": "Tercera", "is_answered": False},
+    ]
+    ctx = SimpleNamespace(str_context="Sección del contrato", section_name="Precio")
+
+    answers = list(stream_answers("Contexto: {context}", ctx, model_name="gpt-4"))
+
+    assert [a.text for a in answers] == ["Primera", "Tercera"]
+    # the response lacks an answer, it is asked again next time
+    assert cache.get_response_cache().stats()["entries"] == 0
+
+
+def test_stream_closed_early_is_recorded(fake_openai):
+    fake_openai.answers = [
+        {"text": "Primera", "is_answered": True},
+        {"text": "Segunda", "is_answered": True},
+    ]
+    ctx = SimpleNamespace(str_context="Sección del contrato", section_name="Precio")
+
+    with usage_scope(document="stream.pdf"):
+        stream = stream_answers("Contexto: {context}", ctx, model_name="gpt-4")
+        assert next(stream).text == "Primera"
+        stream.close()
+
+    totals = get_usage_ledger().totals("document", document="stream.pdf")
+    assert [row["calls"] for row in totals] == [1]
+    assert totals[0]["total_tokens"] > 0
+    assert cache.get_response_cache().stats()["entries"] == 0
+
+
+def test_a_failed_set_keeps_the_other_answers(
+    fake_openai, monkeypatch, pages, doc_index
+):
+    from legal_rag import pipeline
+    from legal_rag.models.clients import get_client_manager
+
+    loops = []
+
+    async def async_oai_chain(extraction_prompt, ctx, **kwargs):
+        loops.append(asyncio.get_running_loop())
+        if ctx.section_name == doc_index.sections[0].name:
+            raise TimeoutError("no answer")
+        return await oai_chain(extraction_prompt, ctx, **kwargs)
+
+    oai_chain = pipeline.async_oai_chain
+    monkeypatch.setattr(pipeline, "async_oai_chain", async_oai_chain)
+    answers = asyncio.run(answer_question_sets(pages, doc_index))
+
+    assert set(answers) == set(all_questions)
+    assert None in answers.values()
+    assert any(answer is not None for answer in answers.values())
+    # the clients of the loop are closed with it
+    assert loops[0] not in get_client_manager()._async_clients
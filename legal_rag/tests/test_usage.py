@@ -0,0 +1,46 @@
+"""Labels and budgets of the usage scopes."""
+
+import asyncio
+
+import pytest
+from legal_rag.models.oai import reserve_token_budget
+from legal_rag.models.usage import (
+    TokenBudget,
+    TokenBudgetExceeded,
+    current_scope,
+    usage_scope,
+)
+
+
+def test_nested_scope_inherits_unset_fields():
+    budget = TokenBudget(100)
+    with usage_scope(document="a.pdf", budget=budget):
+        with usage_scope(document=None, question_set="alcances", budget=None):
+            scope = current_scope()
+    assert scope.document == "a.pdf"
+    assert scope.question_set == "alcances"
+    assert scope.budget is budget
+
+
+def test_concurrent_calls_stop_at_the_budget():
+    budget = TokenBudget(250)
+    issued = []
+
+    async def call(i):
+        with reserve_token_budget(100):
+            issued.append(i)
+            await asyncio.sleep(0.01)
+            budget.spend(100)
+
+    async def main():
+        with usage_scope(budget=budget):
+            return await asyncio.gather(
+                *[call(i) for i in range(4)], return_exceptions=True
+            )
+
+    results = asyncio.run(main())
+    assert len(issued) == 3
+    assert isinstance(results[-1], TokenBudgetExceeded)
+    assert budget.reserved == 0
+    with pytest.raises(TokenBudgetExceeded):
+        budget.check()
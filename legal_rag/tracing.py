@@ -0,0 +1,275 @@
+"""
+Lightweight tracing of the pipeline stages.
+
+Stages are wrapped in nested spans::
+
+    with tracing.request("upload", file=name):
+        with tracing.span("toc_detection") as s:
+            ...
+            s.set(pages=n)
+
+Every finished span adds its duration and its `METRIC_ATTRS` (pages, context
+characters, cache hits, ...) to process-wide metrics, exported in the
+Prometheus text format with `write_prometheus` (LEGAL_RAG_METRICS_FILE).
+`request` spans are the roots: with a trace directory (LEGAL_RAG_TRACE_DIR)
+they are written there as one JSON file per request.
+
+Tracing is off unless LEGAL_RAG_TRACING=1 or `enable` is called. When off,
+`span` returns a shared no-op object, so instrumenting a hot path costs a
+function call and a flag check.
+"""
+
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextvars import ContextVar
+from functools import wraps
+from typing import Dict, List, Optional
+
+_enabled = os.getenv("LEGAL_RAG_TRACING", "0") == "1"
+_trace_dir = os.getenv("LEGAL_RAG_TRACE_DIR")
+# Prometheus text file, rewritten after every request
+_metrics_path = os.getenv("LEGAL_RAG_METRICS_FILE")
+# attributes of the spans that are added up in the metrics, the others
+# (page numbers, model names, ...) only go to the traces
+METRIC_ATTRS = (
+    "pages",
+    "pages_extracted",
+    "sections",
+    "chunks",
+    "context_chars",
+    "prompt_chars",
+    "cache_hits",
+    "cache_misses",
+)
+_current: ContextVar[Optional["Span"]] = ContextVar("legal_rag_span", default=None)
+
+
+def enable(trace_dir: Optional[str] = None, metrics_path: Optional[str] = None):
+    """
+    Turn tracing on, writing the JSON trace of each request to ``trace_dir``
+    and the metrics to ``metrics_path`` after each request.
+    """
+    global _enabled, _trace_dir, _metrics_path
+    _enabled = True
+    _trace_dir = trace_dir or _trace_dir
+    _metrics_path = metrics_path or _metrics_path
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+    def incr(self, key: str, value: float = 1):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    """A timed stage, with attributes and the spans started inside it."""
+
+    def __init__(self, name: str, root: bool = False, **attrs):
+        self.name = name
+        self.root = root
+        self.attrs = attrs
+        self.children: List["Span"] = []
+        self.parent: Optional["Span"] = None
+        self.start = None
+        self.duration = None
+        self.error = None
+        self._token = None
+
+    def __enter__(self):
+        self.parent = None if self.root else _current.get()
+        if self.parent is not None:
+            self.parent.children.append(self)
+        self._token = _current.set(self)
+        self.start = time.time()
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self._t0
+        if exc_type is not None:
+            self.error = exc_type.__name__
+        _current.reset(self._token)
+        METRICS.observe(self)
+        if self.root:
+            write_trace(self)
+            if _metrics_path is not None:
+                write_prometheus(_metrics_path)
+        return False
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def incr(self, key: str, value: float = 1):
+        self.attrs[key] = self.attrs.get(key, 0) + value
+
+    def to_dict(self) -> Dict:
+        data = {
+            "name": self.name,
+            "start": self.start,
+            "duration": self.duration,
+            "attrs": self.attrs,
+            "children": [child.to_dict() for child in self.children],
+        }
+        if self.error is not None:
+            data["error"] = self.error
+        return data
+
+
+def span(name: str, **attrs):
+    """Span of a stage, nested in the current one."""
+    if not _enabled:
+        return NOOP_SPAN
+    return Span(name, **attrs)
+
+
+def request(name: str, **attrs):
+    """Root span of a request, e.g. an upload or a question, with its own trace."""
+    if not _enabled:
+        return NOOP_SPAN
+    attrs.setdefault("trace_id", uuid.uuid4().hex)
+    return Span(name, root=True, **attrs)
+
+
+def traced(name: str):
+    """Decorator running the whole function in a span called ``name``."""
+
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+
+            @wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                if not _enabled:
+                    return await fn(*args, **kwargs)
+                with Span(name):
+                    return await fn(*args, **kwargs)
+
+            return async_wrapper
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with Span(name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def current_span():
+    """The span of the running stage, to add attributes from deeper calls."""
+    span = _current.get() if _enabled else None
+    return span if span is not None else NOOP_SPAN
+
+
+def write_trace(span: Span, trace_dir: Optional[str] = None) -> Optional[str]:
+    trace_dir = trace_dir or _trace_dir
+    if trace_dir is None:
+        return None
+    os.makedirs(trace_dir, exist_ok=True)
+    path = os.path.join(
+        trace_dir, f"{span.name}-{int(span.start)}-{span.attrs['trace_id']}.json"
+    )
+    with open(path, "w") as f:
+        json.dump(span.to_dict(), f, default=str)
+    return path
+
+
+class Metrics:
+    """Totals per stage: number of spans, seconds, errors and numeric attributes."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = defaultdict(int)
+        self.seconds = defaultdict(float)
+        self.errors = defaultdict(int)
+        self.totals = defaultdict(float)
+
+    def observe(self, span: Span):
+        with self._lock:
+            self.counts[span.name] += 1
+            self.seconds[span.name] += span.duration
+            if span.error is not None:
+                self.errors[span.name] += 1
+            for key in METRIC_ATTRS:
+                value = span.attrs.get(key)
+                if value is not None:
+                    self.totals[span.name, key] += value
+
+    def reset(self):
+        with self._lock:
+            self.counts.clear()
+            self.seconds.clear()
+            self.errors.clear()
+            self.totals.clear()
+
+    def prometheus_text(self) -> str:
+        lines = [
+            "# HELP legal_rag_stage_seconds Time spent in each pipeline stage.",
+            "# TYPE legal_rag_stage_seconds summary",
+        ]
+        with self._lock:
+            for stage in sorted(self.counts):
+                lines.append(
+                    f'legal_rag_stage_seconds_sum{{stage="{stage}"}} {self.seconds[stage]:.6f}'
+                )
+                lines.append(
+                    f'legal_rag_stage_seconds_count{{stage="{stage}"}} {self.counts[stage]}'
+                )
+            lines.append("# TYPE legal_rag_stage_errors_total counter")
+            for stage in sorted(self.counts):
+                lines.append(
+                    f'legal_rag_stage_errors_total{{stage="{stage}"}} {self.errors[stage]}'
+                )
+            names = sorted({key for _, key in self.totals})
+            for key in names:
+                metric = f"legal_rag_stage_{key}_total"
+                lines.append(f"# TYPE {metric} counter")
+                for (stage, k), value in sorted(self.totals.items()):
+                    if k == key:
+                        lines.append(f'{metric}{{stage="{stage}"}} {value:g}')
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
+
+
+def write_prometheus(path: str):
+    """
+    Write the metrics to ``path`` (e.g. for node_exporter's textfile collector),
+    atomically so the collector never reads half a file.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(METRICS.prometheus_text())
+    os.replace(tmp_path, path)
+    logging.debug(f"Metrics written to {path}")
@@ -1,8 +1,19 @@
 import base64
+import hashlib
 import io
+import logging
+import math
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
 
 import streamlit as st
 
+# number of page subsets kept in memory
+MAX_CACHED_SUBSETS = 32
+_subsets = OrderedDict()
+_subsets_lock = threading.Lock()
+
 
 def check_streamlit():
     """
@@ -25,19 +36,95 @@ def check_streamlit():
     return use_streamlit
 
 
-def display_document(uploaded_file: io.BytesIO, specific_page: int = None):
+def base64_size(n_bytes: int) -> int:
+    """Length of the base64 encoding of ``n_bytes`` bytes, without encoding them."""
+    return 4 * math.ceil(n_bytes / 3)
+
+
+def pdf_page_subset(
+    pdf_bytes: bytes, start_page: int, end_page: int, file_id: Optional[str] = None
+) -> bytes:
+    """
+    PDF with only the pages ``start_page`` to ``end_page`` (0-based, end
+    exclusive) of ``pdf_bytes``. Subsets are cached by ``file_id`` (the hash
+    of the file when not given) and the page range, so reruns of the app do
+    not write them again.
+    """
+    key = (file_id or hashlib.sha256(pdf_bytes).hexdigest(), start_page, end_page)
+    with _subsets_lock:
+        if key in _subsets:
+            _subsets.move_to_end(key)
+            return _subsets[key]
+
+    from pypdf import PdfReader, PdfWriter
+
+    reader = PdfReader(io.BytesIO(pdf_bytes))
+    writer = PdfWriter()
+    for page in reader.pages[start_page:end_page]:
+        writer.add_page(page)
+    output = io.BytesIO()
+    writer.write(output)
+    subset = output.getvalue()
+
+    with _subsets_lock:
+        _subsets[key] = subset
+        while len(_subsets) > MAX_CACHED_SUBSETS:
+            _subsets.popitem(last=False)
+    return subset
+
+
+def pdf_iframe(pdf_bytes: bytes, page: int = None) -> str:
+    base64_pdf = base64.b64encode(pdf_bytes).decode("utf-8")
+    anchor = f"#page={page}" if page is not None else ""
+    return f'<iframe src="data:application/pdf;base64,{base64_pdf}{anchor}" width="900" height="800"></iframe>'
+
+
+def display_document(
+    uploaded_file: io.BytesIO,
+    specific_page: int = None,
+    page_range: Tuple[int, int] = None,
+):
     """
     Display the contents of a file on Streamlit.
+
+    For PDFs, ``page_range`` (0-based, end exclusive) shows only those pages,
+    which keeps the payload sent to the browser small. The full document can
+    still be opened on demand.
     """
     # Display the document using an iframe
     if uploaded_file.type == "application/pdf":
         # For PDF files
-        pdf_bytes = uploaded_file.read()
-        base64_pdf = base64.b64encode(pdf_bytes).decode("utf-8")
-        st.markdown(
-            f'<iframe src="data:application/pdf;base64,{base64_pdf}#page={specific_page}" width="900" height="800"></iframe>',
-            unsafe_allow_html=True,
-        )
+        pdf_bytes = uploaded_file.getvalue()
+        full_size = base64_size(len(pdf_bytes))
+        show_full = page_range is None or st.checkbox("Show the full document")
+        subset = None
+        if not show_full:
+            start_page, end_page = page_range
+            try:
+                # streamlit's id of the upload, unique per file
+                file_id = getattr(uploaded_file, "file_id", None)
+                subset = pdf_page_subset(pdf_bytes, start_page, end_page, file_id)
+            except Exception as e:
+                logging.warning(f"Could not extract pages {page_range}: {e}")
+
+        if subset is None:
+            st.markdown(pdf_iframe(pdf_bytes, specific_page), unsafe_allow_html=True)
+            logging.info(f"Displayed the full document: {full_size / 1024:.0f} KB")
+        else:
+            page = None
+            if specific_page is not None:
+                page = min(max(specific_page - start_page, 1), end_page - start_page)
+            html = pdf_iframe(subset, page)
+            st.markdown(html, unsafe_allow_html=True)
+            subset_size = base64_size(len(subset))
+            st.caption(
+                f"Pages {start_page + 1} to {end_page}: {subset_size / 1024:.0f} KB "
+                f"instead of {full_size / 1024:.0f} KB for the full document"
+            )
+            logging.info(
+                f"Displayed pages {start_page + 1}-{end_page}: {subset_size / 1024:.0f} KB, "
+                f"full document {full_size / 1024:.0f} KB"
+            )
     elif (
         uploaded_file.type
         == "application/vnd.openxmlformats-officedocument.wordprocessingml.document"